@@ -0,0 +1,116 @@
+import re
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from tracing import tracer
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from hybrid_retriever import extract_years
+
+class SemanticAnswerCache:
+    def __init__(self, embeddings: Embeddings, threshold: float=0.95, ttl: float=24 * 60 * 60, max_entries: int=2000):
+        """
+        In-memory cache of answers keyed by the embedding of the standalone question
+        Entries are scoped (collection + search filter + selected sections), a lookup returns the stored answer and sources of the most
+        similar question in the same scope if its cosine similarity is at least threshold and both questions mention the same
+        years and numbers ('revenue in 2022?' and 'revenue in 2023?' embed almost the same).
+        Entries expire after ttl, least recently used entries are evicted over max_entries and
+        all entries of a collection are dropped when new data is ingested into it.
+        Args:
+            embeddings: embedding model for questions (CachedEmbeddings avoids embedding repeated questions twice)
+            threshold (float): min cosine similarity of questions for a hit
+            ttl (float): seconds an answer is served from the cache
+            max_entries (int): max number of answers in the cache
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # {entry_no: {scope, collection, vector, question, terms, answer, context, created}}
+        self.next_entry_no = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_scope(self, collection_name: str, search_filter=None, sections: dict=None) -> tuple:
+        """
+        Scope of cached answers: collection, the filter selecting the session's filings and the selected sections {item: name}
+        """
+        return (collection_name, repr(search_filter), tuple(sorted(sections or {})))
+
+    def get_terms(self, question: str) -> tuple:
+        """
+        Years and numbers of a question, a cached answer is only served for a question with the same ones
+            'What was revenue in Q3 2023?' -> ((2023,), ('2023', '3'))
+        """
+        return tuple(extract_years(question)), tuple(sorted(set(re.findall(r"\d+(?:[.,]\d+)*", question))))
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, question: str, scope: tuple) -> dict:
+        """
+        Cached answer of the most similar question in scope
+        Args:
+            question (str): standalone question
+            scope (tuple): from get_scope
+        Returns:
+            dict: {"answer", "context"} or None if no question in scope is similar enough
+        """
+        vector = self._embed(question)
+        terms = self.get_terms(question)
+        now = time.time()
+        with self.lock:
+            for entry_no in [entry_no for entry_no, entry in self.entries.items() if now - entry["created"] > self.ttl]:
+                del self.entries[entry_no]
+            candidates = [(entry_no, entry) for entry_no, entry in self.entries.items() if entry["scope"] == scope and entry["terms"] == terms]
+            best = None
+            if candidates:
+                similarities = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+                best_no = int(np.argmax(similarities))
+                if similarities[best_no] >= self.threshold:
+                    best = candidates[best_no]
+            if best is None:
+                self.misses += 1
+                tracer.count("answer_cache.misses")
+                return None
+            entry_no, entry = best
+            self.entries.move_to_end(entry_no)
+            self.hits += 1
+        tracer.count("answer_cache.hits")
+        return {"answer": entry["answer"], "context": [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in entry["context"]]}
+
+    def set(self, question: str, scope: tuple, answer: str, context: list):
+        """
+        Save answer and its source documents for the standalone question
+        """
+        if not answer:
+            return
+        vector = self._embed(question)
+        with self.lock:
+            self.entries[self.next_entry_no] = {"scope": scope, "collection": scope[0], "vector": vector, "question": question, "terms": self.get_terms(question),
+                                                "answer": answer, "context": list(context or []), "created": time.time()}
+            self.next_entry_no += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, collection_name: str=None):
+        """
+        Drop answers of a collection after new data is ingested into it (all answers if collection_name is None)
+        """
+        with self.lock:
+            for entry_no in [entry_no for entry_no, entry in self.entries.items() if collection_name is None or entry["collection"] == collection_name]:
+                del self.entries[entry_no]
+
+    def stats(self) -> dict:
+        """
+        Cache statistics
+        Returns:
+            dict: {hits, misses, hit_rate, entries}
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "entries": len(self.entries)}
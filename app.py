@@ -1,18 +1,31 @@
+import time
+app_start = time.perf_counter()
 import os
-import datetime
+import re
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 import streamlit as st
 from llmrag import LlmRag
 from scraper import Scraper
 from fetchfilings import FetchFilings
+from edgar_client import EdgarClient
+from company_directory import CompanyDirectory
 from sec_api import ExtractorApi
+from section_cache import SectionCache, CachedExtractorApi
+from sectionizer import LocalExtractorApi
 from qdrant_vectors_manager import QdrantVectorsManager
+from tracing import tracer, TracingCallbackHandler
 from qdrant_client import QdrantClient
-from langchain_openai import OpenAIEmbeddings
+from embedding_cache import CachedEmbeddings
+from answer_cache import SemanticAnswerCache
+from ingestion_manifest import IngestionManifest
+from xbrl_facts import XbrlFacts
+from session_store import SessionStore
+from embedding_backends import EmbeddingBackend
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_community.chat_message_histories import ChatMessageHistory
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
@@ -24,86 +37,38 @@ NAME = st.secrets["NAME"]
 EMAIL = st.secrets["EMAIL"]
 headers = {"User-Agent": f"{NAME} {EMAIL}",}
 llm_rag = LlmRag()
-fetch_filings = FetchFilings(headers)
+embedding_backend = EmbeddingBackend()
 qdrant_vectorstore = QdrantVectorsManager()
 embedding_model_openai = "text-embedding-3-small"
+embedding_model_fastembed = "BAAI/bge-small-en-v1.5"
+embedding_model_dir = os.environ.get("FASTEMBED_MODEL_DIR") # Local fastembed model directory for offline use
+embedding_dimensions = None # Shortened OpenAI embeddings (e.g. 512), None for full size
+storage_profile = "default" # Qdrant storage of new collections: 'default', 'int8', 'binary', 'compact' (see benchmark.py --storage-report)
 show_recent_n_chats = 10
+chat_history_turns = 2 # Conversations of the chat history given to the LLM
+session_store_path = ".cache/sessions.sqlite"
+collection_max_idle = 6 * 60 * 60 # Per-session collections unused for this long are deleted
+chat_history_max_age = 30 * 24 * 60 * 60
 fetch_recent_n_years_filings = 5
-
-
-# Streamlit UI: Session variables for UI
-if 'is_configured' not in st.session_state:
-    st.session_state.is_configured = False
-if 'data_fetched' not in st.session_state:
-    st.session_state.data_fetched = False
-
-# Utility Functions to manage UI
-def get_new_session():
-    """
-    Get new session id based on current datetime.
-    sets session variable session_id
-    """
-    now = datetime.datetime.now()
-    st.session_state.session_id = now.strftime("%Y%m%d%H%M%S%f")
-def get_current_session():
-    """
-    Get current session id from session state
-    """
-    return st.session_state.session_id
-def get_session_history(session_id:str)->BaseChatMessageHistory:
-    """
-    Get chat history based on provided session
-    Args:
-        session_id (str): history to be fetched for session id
-    Returns:
-        store (BaseChatMessageHistory): chat history of provided session id
-    """
-    session_id = get_current_session() if not session_id else session_id
-    if session_id not in st.session_state.store:
-        st.session_state.store[session_id]=ChatMessageHistory()
-    return st.session_state.store[session_id]
-def trim_chat_history(session_id, n:int = 10):
-    """
-    Keep only last 'n' conversations in the chat history
-    Args:
-        Session_id: session id for which chats to remove
-        n: number of chats to keep
-    """
-    if session_id not in st.session_state.store:
-        return
-    qa_pairs = []
-    temp_pair = []
-    chat_history = st.session_state.store[session_id].messages
-
-    for message in chat_history:
-        if isinstance(message, HumanMessage):
-            # When HumanMessage starts, save any previous pair and start a new one
-            if temp_pair:
-                qa_pairs.append(temp_pair)
-            temp_pair = [message]
-        elif isinstance(message, AIMessage):
-            # Append AI response to the current pair
-            if temp_pair:
-                temp_pair.append(message)
-                qa_pairs.append(temp_pair)
-                temp_pair = []
-    # Last temp_pair (AI Message) added 
-    if temp_pair:
-        qa_pairs.append(temp_pair)
-    
-    # Keep last n conversations
-    trimmed_history = qa_pairs[-n:]
-    st.session_state.store[session_id].messages = [msg for pair in trimmed_history for msg in pair]
-
-    return st.session_state.store[session_id].messages
-def show_chat_history(session_id=None, last_n_chats: int=2):
-    """
-    Fetches chat history from store{} for provided session_id after keeping only n latest chats
-    Args:
-        session_id (str): Session Id for which chat history to be fetched
-        last_n_chats (int): Show only Last 'n' chats for the provided session ID
-    """
-    st.markdown("""
+ingestion_workers = 8
+section_cache_dir = ".cache/sections"
+section_cache_max_bytes = 512 * 1024 * 1024
+embedding_cache_path = ".cache/embeddings.sqlite"
+ingestion_manifest_path = ".cache/ingestion_manifest.sqlite"
+use_shared_corpus = True # One deduplicated collection for all sessions, sessions search it with filters
+shared_collection_name = "sec_filings_10k"
+show_top_n_companies = 20
+max_companies = 4 # Companies compared in one session (multi-company mode)
+use_hybrid_retrieval = True # BM25 + dense search, years/sections in questions filter the search
+use_answer_cache = True # Answers of repeated (similar) questions over the same filings are served from cache
+answer_cache_threshold = 0.95
+answer_cache_ttl = 24 * 60 * 60
+use_context_packing = True # Merge adjacent chunks, drop near duplicates and fit the context to the LLM's token budget
+use_fast_query_planning = True # Skip the standalone question rewrite for questions without references to the chat history
+use_xbrl_facts = True # Numeric questions (revenue, net income, EPS, ... by fiscal year) are answered from the XBRL financial data
+xbrl_store_dir = ".cache/xbrl"
+# Chat bubbles, injected once per run
+chat_css = """
         <style>
         .human-message {
             text-align: right;
@@ -146,11 +111,122 @@ def show_chat_history(session_id=None, last_n_chats: int=2):
             }
         }
         </style>
-        """, unsafe_allow_html=True)
+        """
 
+
+# Streamlit UI: Session variables for UI
+if 'is_configured' not in st.session_state:
+    st.session_state.is_configured = False
+if 'data_fetched' not in st.session_state:
+    st.session_state.data_fetched = False
+
+# Utility Functions to manage UI
+@st.cache_resource
+def get_edgar_client():
+    """
+    EDGAR http client (connection pool, rate limiter, response cache), shared by all sessions of the app
+    """
+    return EdgarClient(headers)
+@st.cache_resource
+def get_section_cache():
+    """
+    Section text cache on disk, shared by all sessions of the app
+    """
+    return SectionCache(cache_dir=section_cache_dir, max_bytes=section_cache_max_bytes)
+@st.cache_resource
+def get_company_directory():
+    """
+    Company directory (ticker, cik, name index), shared by all sessions of the app
+    """
+    return CompanyDirectory(headers, client=get_edgar_client())
+@st.cache_resource
+def get_app_stats():
+    """
+    Number of script runs of this process, the first run is the cold start
+    """
+    return {"runs": 0}
+@st.cache_resource
+def get_qdrant_client():
+    """
+    Qdrant client (HTTP connection pool), shared by all sessions of the app
+    """
+    return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY,)
+@st.cache_resource
+def get_llm(provider: str, api_key: str):
+    """
+    LLM client for provider and api key, shared by all sessions using them
+    """
+    return llm_rag.get_llm(provider=provider, api_key=api_key)
+@st.cache_resource
+def get_embeddings(provider: str, api_key: str, model_name: str, dimensions: int):
+    """
+    Cached embedding model for provider, model and api key, shared by all sessions using them (a local model is loaded once)
+    Returns:
+        tuple: (CachedEmbeddings, VectorParams, namespace)
+    """
+    embeddings, vector_params, namespace = embedding_backend.get_embeddings(provider=provider, api_key=api_key, model_name=model_name,
+                                                                            model_dir=embedding_model_dir, dimensions=dimensions)
+    return CachedEmbeddings(embeddings, namespace=namespace, cache_path=embedding_cache_path), vector_params, namespace
+@st.cache_resource
+def get_xbrl_facts():
+    """
+    XBRL company facts store, shared by all sessions of the app
+    """
+    return XbrlFacts(get_edgar_client(), store_dir=xbrl_store_dir)
+@st.cache_resource
+def get_ingestion_manifest():
+    """
+    Ingestion manifest of (filing, section) units in each collection, shared by all sessions of the app
+    """
+    return IngestionManifest(ingestion_manifest_path)
+@st.cache_resource
+def get_session_store():
+    """
+    Chat histories and per-session collections on disk, shared by all sessions of the app
+    Idle per-session collections and old chat histories are deleted in the background.
+    """
+    session_store = SessionStore(session_store_path)
+    session_store.start_reaper(get_qdrant_client(), max_idle=collection_max_idle, history_max_age=chat_history_max_age, manifest=get_ingestion_manifest())
+    return session_store
+@st.cache_resource
+def get_answer_cache(embedding_namespace: str, _embeddings):
+    """
+    Semantic answer cache for an embedding model, shared by all sessions of the app
+    """
+    return SemanticAnswerCache(_embeddings, threshold=answer_cache_threshold, ttl=answer_cache_ttl)
+fetch_filings = FetchFilings(headers, client=get_edgar_client())
+def get_new_session():
+    """
+    Get new random session id (unguessable, it is the only key to the session's chat history in the url)
+    sets session variable session_id
+    """
+    st.session_state.session_id = secrets.token_urlsafe(24)
+    # Kept in the url, the chat history is restored when the page is reloaded
+    st.query_params["session"] = st.session_state.session_id
+def get_current_session():
+    """
+    Get current session id from session state
+    """
+    return st.session_state.session_id
+def get_session_history(session_id:str)->BaseChatMessageHistory:
+    """
+    Get chat history based on provided session
+    Args:
+        session_id (str): history to be fetched for session id
+    Returns:
+        store (BaseChatMessageHistory): chat history of provided session id, the last chat_history_turns conversations are given to the LLM
+    """
+    session_id = get_current_session() if not session_id else session_id
+    return get_session_store().get_history(session_id, last_n_turns=chat_history_turns)
+def show_chat_history(session_id=None, last_n_chats: int=2):
+    """
+    Fetches the n latest chats of the provided session_id from the session store
+    Args:
+        session_id (str): Session Id for which chat history to be fetched
+        last_n_chats (int): Show only Last 'n' chats for the provided session ID
+    """
     session_id = get_current_session() if not session_id else session_id
-    trim_chat_history(session_id, last_n_chats)
-    chat_history = get_session_history(session_id).messages
+    chat_history = get_session_store().get_messages(session_id, last_n_turns=last_n_chats)
     for message in chat_history:
         if isinstance(message, AIMessage):
             message_content = message.content
@@ -167,20 +243,31 @@ def clear_input():
     st.session_state.text_input=""  
 
 # UI Components
+st.markdown(chat_css, unsafe_allow_html=True)
 st.title("SEC Filing (10-K) Q&A")
 
 # Sidebar for API keys and LLM selection
 st.sidebar.title("Configurations")
 llm_provider = st.sidebar.selectbox("Select LLM Company", ["Groq", "OpenAI",])
+embedding_provider = st.sidebar.selectbox("Select Embeddings", ["OpenAI", "FastEmbed",], help="FastEmbed runs a local model on CPU, no API key needed")
 openai_api_key = st.sidebar.text_input("OpenAI [API Key](https://platform.openai.com/api-keys) - Embeddings", type="password")
 sec_api_key = st.sidebar.text_input("SEC Filings - Edgar [API Key](https://sec-api.io/)", type="password")
+with st.sidebar.expander("EDGAR requests"):
+    st.json(get_edgar_client().metrics())
+rerun_placeholder = st.sidebar.empty()
+with st.sidebar.expander("Performance"):
+    st.dataframe(tracer.summary(), hide_index=True)
+    st.json(tracer.counters)
+    st.json(get_session_store().stats())
+    st.download_button("Export JSON lines", tracer.export_jsonl(), file_name="traces.jsonl")
+    st.download_button("Export Prometheus", tracer.export_prometheus(), file_name="metrics.prom")
 
 # Configure Button to process and initialize everything
 if st.sidebar.button("Configure"):
     # Error if anything is missing
     if not llm_provider:
         st.sidebar.error("Please select a valid llm provider.")
-    elif not openai_api_key:
+    elif not openai_api_key and "OpenAI" in (llm_provider, embedding_provider):
         st.sidebar.error("Please enter a valid OpenAI API key.")
     elif not sec_api_key:
         st.sidebar.error("Please enter a valid SEC API Key.")
@@ -188,23 +275,43 @@ if st.sidebar.button("Configure"):
     else:
         # Setting up session variables
         with st.spinner('Configuring...'):
-            if 'store' not in st.session_state:
-                st.session_state.store={}
             if 'session_id' not in st.session_state:
-                get_new_session()
+                # Only ids generated by get_new_session are restored, not guessable ones (e.g. old timestamp ids)
+                if re.fullmatch(r"[A-Za-z0-9_-]{32}", st.query_params.get("session", "")):
+                    st.session_state.session_id = st.query_params["session"]
+                else:
+                    get_new_session()
             if 'llm' not in st.session_state:
                 api_key = openai_api_key if llm_provider == "OpenAI" else GROQ_API_KEY if llm_provider == 'Groq' else None
-                st.session_state.llm = llm_rag.get_llm(provider=llm_provider, api_key=api_key)
+                st.session_state.llm = get_llm(provider=llm_provider, api_key=api_key)
+                st.session_state.context_tokens = llm_rag.get_context_budget(llm_provider) if use_context_packing else None
             if 'extractorApi' not in st.session_state:
-                st.session_state.extractorApi = ExtractorApi(sec_api_key)
+                # 10-K is downloaded once and split into Items locally, sec-api is used only as fallback
+                extractor = LocalExtractorApi(headers, fallback=ExtractorApi(sec_api_key), client=get_edgar_client())
+                st.session_state.extractorApi = CachedExtractorApi(extractor, get_section_cache())
             if 'qdrant_client' not in st.session_state:
-                st.session_state.qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY,)
+                st.session_state.qdrant_client = get_qdrant_client()
             if 'embeddings' not in st.session_state:
-                st.session_state.embeddings = OpenAIEmbeddings(model=embedding_model_openai, openai_api_key=openai_api_key)
+                model_name = embedding_model_openai if embedding_provider == "OpenAI" else embedding_model_fastembed
+                st.session_state.embeddings, st.session_state.vector_params, st.session_state.embedding_namespace = get_embeddings(
+                    provider=embedding_provider, api_key=openai_api_key if embedding_provider == "OpenAI" else None, model_name=model_name, dimensions=embedding_dimensions)
             if 'vector_store' not in st.session_state:
-                st.session_state.vector_store = qdrant_vectorstore.initialize_vectorstore(collection_name = st.session_state.session_id, 
-                                                                                qdrant_client = st.session_state.qdrant_client,
-                                                                                embeddings = st.session_state.embeddings)
+                if use_shared_corpus:
+                    collection_name = qdrant_vectorstore.get_shared_collection_name(shared_collection_name, st.session_state.embedding_namespace)
+                    st.session_state.vector_store = qdrant_vectorstore.initialize_shared_vectorstore(collection_name = collection_name,
+                                                                                    qdrant_client = st.session_state.qdrant_client,
+                                                                                    embeddings = st.session_state.embeddings,
+                                                                                    vector_params = st.session_state.vector_params,
+                                                                                    storage_profile = storage_profile)
+                else:
+                    st.session_state.vector_store = qdrant_vectorstore.initialize_vectorstore(collection_name = st.session_state.session_id, 
+                                                                                    qdrant_client = st.session_state.qdrant_client,
+                                                                                    embeddings = st.session_state.embeddings,
+                                                                                    vector_params = st.session_state.vector_params,
+                                                                                    storage_profile = storage_profile)
+                    get_session_store().register_collection(st.session_state.session_id, st.session_state.session_id)
+            if 'search_filter' not in st.session_state:
+                st.session_state.search_filter = None
             if 'query' not in st.session_state:
                 st.session_state.query=""
             if 'last_n_chats' not in st.session_state:
@@ -217,35 +324,52 @@ if st.sidebar.button("Configure"):
 
 # Main Screen
 if st.session_state.is_configured:
-    # Getting list of companies and cik from EDGAR
-    company_tickers = fetch_filings.get_companies_cik()
-    selected_company = st.selectbox("Choose a company", [""] +list(company_tickers.keys()))
-    if selected_company:
-        # Getting Cik from the Selected Company
-        cik = company_tickers[selected_company]
-        selected_filings = []
-        # Fetching 10K filings using cik of the selected company
-        filings = fetch_filings.get_recent_filings_10K(cik=cik, count=fetch_recent_n_years_filings) # Limit max to 5 years filings
+    # Per-session collection deleted by the reaper after the session was idle: created again, data has to be fetched again
+    if not use_shared_corpus and not get_session_store().touch_collection(st.session_state.vector_store.collection_name):
+        st.session_state.vector_store = qdrant_vectorstore.initialize_vectorstore(collection_name = st.session_state.session_id,
+                                                                        qdrant_client = st.session_state.qdrant_client,
+                                                                        embeddings = st.session_state.embeddings,
+                                                                        vector_params = st.session_state.vector_params,
+                                                                        storage_profile = storage_profile)
+        get_session_store().register_collection(st.session_state.session_id, st.session_state.session_id)
+        if st.session_state.data_fetched:
+            st.info("The data of this session expired, please fetch it again.")
+        st.session_state.data_fetched = False
+    # Searching companies by ticker, cik or name in the cached EDGAR company list
+    company_directory = get_company_directory()
+    company_query = st.text_input("Search company", placeholder="Ticker, CIK or company name")
+    # Companies already chosen stay in the options while searching for the next one
+    company_options = list(dict.fromkeys(st.session_state.get('selected_companies', []) + company_directory.search(company_query, limit=show_top_n_companies)))
+    selected_companies = st.multiselect("Choose companies", company_options, key='selected_companies', max_selections=max_companies,
+                                        help="Choose several companies to compare them")
+    if selected_companies:
+        # Getting Cik from the Selected Companies
+        ciks = {company: company_directory.get_cik(company) for company in selected_companies}
+        # Fetching 10K filings using cik of the selected companies, concurrently
+        with ThreadPoolExecutor(max_workers=len(ciks)) as executor:
+            company_filings = dict(zip(ciks, executor.map(lambda cik: fetch_filings.get_recent_filings_10K(cik=cik, count=fetch_recent_n_years_filings), ciks.values()))) # Limit max to 5 years filings
 
         # Checkbox for 10k filings based on filing dates
-        st.write("###### Select filings")
-        selected_filings = []
+        selected_filings = {}
         cols_per_row = 5
-        num_filings = len(filings)
-        for i in range(0, num_filings, cols_per_row):
-            cols = st.columns(cols_per_row)
-            for j, col in enumerate(cols):
-                if i + j < num_filings:
-                    filing = filings[i + j]
-                    with col:
-                        if st.checkbox(filing['date']):
-                            selected_filings.append(filing)
+        for company, filings in company_filings.items():
+            st.write(f"###### Select filings - {company}" if len(company_filings) > 1 else "###### Select filings")
+            selected_filings[company] = []
+            num_filings = len(filings)
+            for i in range(0, num_filings, cols_per_row):
+                cols = st.columns(cols_per_row)
+                for j, col in enumerate(cols):
+                    if i + j < num_filings:
+                        filing = filings[i + j]
+                        with col:
+                            if st.checkbox(filing['date'], key=f"filing_{filing['accession']}"):
+                                selected_filings[company].append(filing)
         # Checkbox for "Search Web"
         st.write('###### Search Web?')
         col1, col2, col3 = st.columns([1, 1, 1])  
         with col1:
             search_web = st.checkbox("Search Web")
-        filings = selected_filings
+        filings = [filing for company_selected_filings in selected_filings.values() for filing in company_selected_filings]
 
         # Checkbox for 10K Sections for a filing
         st.write("###### Select Sections for filing")
@@ -265,44 +389,123 @@ if st.session_state.is_configured:
         # Fetch Data Button to gather data and save it in Qdrant VectorStore
         if st.button("Fetch Data"):
             st.session_state.sections = selected_sections
+            ingest_stats = {}
+            # Web data and XBRL facts of all companies are fetched while the filings are ingested
+            executor = ThreadPoolExecutor(max_workers=2 * len(ciks))
+            web_futures = {company: executor.submit(Scraper(ticker=company.split('(')[-1].strip(') '), company_name=company.split('(')[0].strip()).get_web_data)
+                           for company in ciks} if search_web else {}
+            facts_futures = [executor.submit(get_xbrl_facts().get_company, cik) for cik in ciks.values()] if use_xbrl_facts else []
             with st.spinner('Extracting data from EDGAR API...'):
-                qdrant_vectorstore.save_to_vectorstore(data=filings, vector_store=st.session_state.vector_store, type_of_data='filings', sections=st.session_state.sections, extractorApi=st.session_state.extractorApi)
+                # Sections of all companies' filings share one worker pool
+                errors = qdrant_vectorstore.save_to_vectorstore(data=filings, vector_store=st.session_state.vector_store, type_of_data='filings', sections=st.session_state.sections, extractorApi=st.session_state.extractorApi,
+                                                                max_workers=ingestion_workers, stats=ingest_stats, manifest=get_ingestion_manifest())
                 # st.write("Selected filings have been processed and saved to the vector store.")
+            cache_stats = get_section_cache().stats()
+            st.caption(f"Sections: {ingest_stats['sections']} new, {ingest_stats['skipped']} already indexed, {len(errors)} failed (retried on next Fetch Data)")
+            st.caption(f"Section cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+            if errors:
+                with st.expander(f"{len(errors)} section(s) could not be fetched"):
+                    for error in errors:
+                        st.write(f"{error['url']} - Item {error['section']} ({error['stage']}): {error['error']}")
             if search_web:
-                ticker = selected_company.split('(')[-1].strip(') ')
-                company_name = selected_company.split('(')[0].strip()
-                webscraper = Scraper(ticker=ticker, company_name=company_name)
-                with st.spinner('Gathering stock info from web..'):
-                    stock_info = webscraper.get_stock_info()
-                    qdrant_vectorstore.save_to_vectorstore(data=stock_info, vector_store=st.session_state.vector_store, type_of_data='stock_info')
-                with st.spinner('Gathering latest news from news.google.com..'):
-                    news_info = webscraper.get_finance_news_gglnews()
-                    qdrant_vectorstore.save_to_vectorstore(data=news_info, vector_store=st.session_state.vector_store, type_of_data='news')
-                with st.spinner('Gathering latest news from google.com..'):
-                    news_info = webscraper.get_finance_news_gglsrch()
-                    qdrant_vectorstore.save_to_vectorstore(data=news_info, vector_store=st.session_state.vector_store, type_of_data='news')
-                # st.write(f"Web data for {selected_company} has been scraped and saved to the vector store.")
+                with st.spinner('Gathering stock info and latest news from web..'):
+                    for company, future in web_futures.items():
+                        web_data = future.result()
+                        qdrant_vectorstore.save_to_vectorstore(data=web_data, vector_store=st.session_state.vector_store, type_of_data='web', cik=ciks[company])
+                        missing_sources = [source for source in ("stock_info", "news_gglnews", "news_gglsrch") if source not in web_data]
+                        if missing_sources:
+                            st.caption(f"Web sources skipped for {company} (timed out or failed): {', '.join(missing_sources)}")
+                # st.write(f"Web data for {company} has been scraped and saved to the vector store.")
+            # Cached answers of the collection are stale once new data is added
+            if ingest_stats["chunks"] or search_web:
+                get_answer_cache(st.session_state.embedding_namespace, st.session_state.embeddings).invalidate(st.session_state.vector_store.collection_name)
             
+            if use_xbrl_facts:
+                with st.spinner('Loading XBRL financial data...'):
+                    for future in facts_futures:
+                        future.result()
+                st.session_state.ciks = list(ciks.values())
+            executor.shutdown()
+
+            if use_shared_corpus:
+                st.session_state.search_filter = qdrant_vectorstore.get_filter(filings=filings, cik=list(ciks.values()) if search_web else None,
+                                                                              sections=st.session_state.sections)
+            # Multi-company mode: every company is searched with its own filter
+            if len(ciks) > 1:
+                st.session_state.company_filters = {company: qdrant_vectorstore.get_filter(filings=selected_filings[company], cik=cik if search_web else None,
+                                                                                             sections=st.session_state.sections) if use_shared_corpus
+                                                    else qdrant_vectorstore.get_company_filter(cik) for company, cik in ciks.items()}
+            else:
+                st.session_state.company_filters = None
             st.session_state.data_fetched = True
+            # Rebuild the chain for the new filter and data
+            st.session_state.conversational_rag_chain = None
         
     # Begin Q&A after vectorstore    
     if st.session_state.data_fetched:
-        # Prepare RAG Chain from vectorestore and llm
-        rag_chain = llm_rag.get_rag_chain(vectorstore = st.session_state.vector_store, llm = st.session_state.llm) 
+        # Prepare RAG Chain from vectorestore and llm, built once per fetched data and reused by the reruns of the session
+        if st.session_state.get('conversational_rag_chain') is None:
+            rag_chain = llm_rag.get_rag_chain(vectorstore = st.session_state.vector_store, llm = st.session_state.llm, search_filter = st.session_state.search_filter,
+                                              hybrid = use_hybrid_retrieval, sections = fetch_filings.get_sections_10K(),
+                                              answer_cache = get_answer_cache(st.session_state.embedding_namespace, st.session_state.embeddings) if use_answer_cache else None,
+                                              fast_rewrite = use_fast_query_planning, context_tokens = st.session_state.context_tokens,
+                                              search_params = qdrant_vectorstore.get_search_params(storage_profile),
+                                              xbrl_facts = get_xbrl_facts() if use_xbrl_facts else None, ciks = st.session_state.get('ciks'),
+                                              company_filters = st.session_state.get('company_filters'), selected_sections = st.session_state.sections)
+            st.session_state.conversational_rag_chain = RunnableWithMessageHistory(rag_chain, get_session_history, input_messages_key="input", history_messages_key="chat_history", output_messages_key="answer")
+        conversational_rag_chain = st.session_state.conversational_rag_chain
 
         # Chat history container
         chat_placeholder = st.empty()
         with chat_placeholder.container():
             show_chat_history()
 
-        # Taking user Query and getting answer from LLM
+        # Streamed answer of the current question
+        stream_placeholder = st.empty()
+
+        # Taking user Query and streaming answer from LLM
         st.text_input(placeholder="Ask your question here", label="Question", label_visibility="collapsed", key='text_input', on_change=clear_input)
         if st.session_state.query:
-            with st.spinner('Thinking...'):
-                config = {"configurable": {"session_id":get_current_session()}}
-                conversational_rag_chain=RunnableWithMessageHistory(rag_chain, get_session_history, input_messages_key="input", history_messages_key="chat_history", output_messages_key="answer")
-                response = conversational_rag_chain.invoke({"input": st.session_state.query}, config=config)
+            config = {"configurable": {"session_id":get_current_session()}, "callbacks": [TracingCallbackHandler(tracer)]}
+            with stream_placeholder.container():
+                st.markdown(f"<div class='human-message'>{st.session_state.query}</div>", unsafe_allow_html=True)
+                sources_placeholder = st.empty()
+                answer_placeholder = st.empty()
+                answer_placeholder.markdown("<div class='ai-message'>Thinking...</div>", unsafe_allow_html=True)
+                answer = ""
+                start = time.perf_counter()
+                st.session_state.query_plan = {}
+                for event, value in llm_rag.stream_answer(conversational_rag_chain, st.session_state.query, config):
+                    if event == "plan":
+                        st.session_state.query_plan = value
+                    elif event == "context":
+                        st.session_state.sources = [doc.metadata for doc in value]
+                        sources_placeholder.caption("Sources: " + ", ".join(f"{metadata.get('section', metadata.get('details', ''))} ({metadata.get('filing date', '')})" for metadata in st.session_state.sources))
+                    elif event == "answer":
+                        answer += value
+                        answer_placeholder.markdown(f"<div class='ai-message'>{answer}▌</div>", unsafe_allow_html=True)
+                st.session_state.query_plan["latency"] = time.perf_counter() - start
+            stream_placeholder.empty()
             st.session_state.query = ""
+
+        # Latency and query plan of the last answer
+        if st.session_state.get('query_plan'):
+            query_plan = st.session_state.query_plan
+            st.caption(f"Answered in {query_plan['latency']:.2f}s" + (f" ({query_plan['plan'].replace('_', ' ')}{', cached' if query_plan['cached'] else ''}, "
+                                                                     f"{query_plan['llm_calls_saved']} LLM call(s) saved)" if 'plan' in query_plan else ""))
+        # Sources of the last answer
+        if st.session_state.get('sources'):
+            with st.expander(f"Sources ({len(st.session_state.sources)})"):
+                for metadata in st.session_state.sources:
+                    st.caption(" | ".join(f"{key}: {value}" for key, value in metadata.items() if key not in ('_id', '_collection_name')))
             
         with chat_placeholder.container():
-            show_chat_history(last_n_chats=st.session_state.last_n_chats)
\ No newline at end of file
+            show_chat_history(last_n_chats=st.session_state.last_n_chats)
+
+# Script run time: the first run of the process includes imports and model/client loading, reruns reuse the cached resources
+app_stats = get_app_stats()
+app_stats["runs"] += 1
+run_type = "app.cold_start" if app_stats["runs"] == 1 else "app.rerun"
+run_duration = time.perf_counter() - app_start
+tracer.record(run_type, time.time() - run_duration, run_duration)
+rerun_placeholder.caption(f"{'Cold start' if run_type == 'app.cold_start' else 'Rerun'}: {run_duration:.2f}s")
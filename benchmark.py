@@ -0,0 +1,378 @@
+"""
+Offline benchmark of ingestion throughput and query latency
+
+Runs entirely locally: a fake ExtractorApi serves recorded (or generated) 10-K section text,
+Qdrant runs in memory, embeddings are deterministic fakes and the LLM is a stub with configurable latency.
+
+Example:
+    python benchmark.py --filings 1,2,5 --sections 5,20 --sessions 1,4,8 --output benchmark_results.json
+
+Storage report (recall vs latency vs RAM of the Qdrant storage profiles, needs a local Qdrant server):
+    docker run -p 6333:6333 qdrant/qdrant
+    python benchmark.py --storage-report --qdrant-url http://localhost:6333 --points 20000 --dimensions 1536,512
+"""
+import os
+import json
+import time
+import random
+import argparse
+import warnings
+import resource
+import subprocess
+import numpy as np
+from typing import Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from qdrant_client.http.models import Distance, VectorParams
+from langchain_core.language_models.llms import LLM
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from llmrag import LlmRag
+from ratelimiter import RateLimiter
+from fetchfilings import FetchFilings
+from qdrant_vectors_manager import QdrantVectorsManager, STORAGE_PROFILES
+
+WORDS = ("revenue net income operating margin risk factors competition supply chain regulation cybersecurity liquidity "
+         "capital resources fiscal year segment products services customers markets growth decline interest rates "
+         "inflation foreign currency litigation intellectual property research development employees tax goodwill").split()
+
+
+class FakeExtractorApi:
+    def __init__(self, recordings_dir: str=None, latency: float=0.0, section_chars: int=30_000):
+        """
+        Stand-in for sec-api ExtractorApi serving recorded section text
+        Args:
+            recordings_dir (str): directory with recorded sections '<item>.txt' (e.g. '1A.txt'), generated text if missing
+            latency (float): seconds of simulated network latency per call
+            section_chars (int): size of generated sections
+        """
+        self.recordings_dir = recordings_dir
+        self.latency = latency
+        self.section_chars = section_chars
+
+    def get_section(self, filing_url: str, section: str, return_type: str="text") -> str:
+        time.sleep(self.latency)
+        if self.recordings_dir:
+            path = os.path.join(self.recordings_dir, f"{section}.txt")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    return f.read()
+        # Deterministic text for the same (filing, section)
+        rng = random.Random(f"{filing_url}|{section}")
+        paragraphs, size = [], 0
+        while size < self.section_chars:
+            paragraph = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + "."
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        return "\n\n".join(paragraphs)
+
+
+class StubLLM(LLM):
+    """
+    LLM returning a fixed answer after a configurable latency
+    """
+    latency: float = 0.2
+    answer: str = "Stub answer based on the retrieved context."
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        time.sleep(self.latency)
+        return self.answer
+
+
+def get_fake_filings(n: int) -> list:
+    """
+    Fake filings in the same format as FetchFilings.get_recent_filings_10K
+    """
+    return [{"url": f"https://www.sec.gov/Archives/edgar/data/1/{i:018d}/fake-10k.htm",
+             "date": f"{2024 - i}-02-01",
+             "cik": "0000000001",
+             "accession": f"0000000001-{24 - i:02d}-{i:06d}",} for i in range(n)]
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB (ru_maxrss is KB on linux, bytes on macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    def __init__(self, extractorApi: FakeExtractorApi, llm_latency: float=0.2, embedding_size: int=256, hybrid: bool=False, workers: int=8,
+                 extractor_rate: float=1000):
+        """
+        Benchmark of save_to_vectorstore and get_rag_chain against local stand-ins
+        Args:
+            extractorApi: FakeExtractorApi serving section text
+            llm_latency (float): seconds per stub LLM call
+            embedding_size (int): size of fake embeddings
+            hybrid (bool): use HybridRetriever in the rag chain
+            workers (int): max_workers of save_to_vectorstore
+            extractor_rate (float): ExtractorApi requests/second allowed by the rate limiter
+        """
+        self.extractorApi = extractorApi
+        self.llm = StubLLM(latency=llm_latency)
+        self.embeddings = DeterministicFakeEmbedding(size=embedding_size)
+        self.vector_params = VectorParams(size=embedding_size, distance=Distance.COSINE)
+        self.hybrid = hybrid
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate=extractor_rate)
+        self.qdrant_client = QdrantClient(":memory:")
+        self.qdrant_vectorstore = QdrantVectorsManager()
+        self.llm_rag = LlmRag()
+        self.all_sections = FetchFilings({}).get_sections_10K()
+
+    def run_ingestion(self, n_filings: int, n_sections: int):
+        """
+        Ingest n_filings x n_sections into a new in-memory collection
+        Returns:
+            tuple: (result dict, vector store)
+        """
+        collection_name = f"bench_{n_filings}_{n_sections}_{time.time_ns()}"
+        vector_store = self.qdrant_vectorstore.initialize_vectorstore(collection_name=collection_name, qdrant_client=self.qdrant_client,
+                                                                      embeddings=self.embeddings, vector_params=self.vector_params)
+        sections = dict(list(self.all_sections.items())[:n_sections])
+        stats = {}
+        start = time.perf_counter()
+        errors = self.qdrant_vectorstore.save_to_vectorstore(data=get_fake_filings(n_filings), vector_store=vector_store, type_of_data='filings',
+                                                             sections=sections, extractorApi=self.extractorApi, max_workers=self.workers,
+                                                             rate_limiter=self.rate_limiter, stats=stats)
+        seconds = time.perf_counter() - start
+        return {"filings": n_filings,
+                "sections": n_sections,
+                "seconds": seconds,
+                "sections_per_sec": stats["sections"] / seconds,
+                "chunks": stats["chunks"],
+                "chunks_per_sec": stats["chunks"] / seconds,
+                "errors": len(errors),
+                "peak_rss_mb": get_peak_rss_mb(),}, vector_store
+
+    def run_queries(self, vector_store, sessions: int, queries_per_session: int):
+        """
+        Run questions through get_rag_chain from concurrent sessions
+        Returns:
+            dict: query latency p50/p95/mean and queries per second
+        """
+        rag_chain = self.llm_rag.get_rag_chain(vectorstore=vector_store, llm=self.llm, hybrid=self.hybrid, sections=self.all_sections)
+        questions = ["What are the main risk factors?", "Summarize liquidity and capital resources.", "How did revenue change in 2023?",
+                     "What does the company say about cybersecurity?", "Describe competition in its markets."]
+
+        def session(session_no: int) -> list:
+            latencies = []
+            for i in range(queries_per_session):
+                start = time.perf_counter()
+                rag_chain.invoke({"input": questions[(session_no + i) % len(questions)], "chat_history": []})
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            latencies = [latency for result in executor.map(session, range(sessions)) for latency in result]
+        seconds = time.perf_counter() - start
+        return {"sessions": sessions,
+                "queries": len(latencies),
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p95": percentile(latencies, 0.95),
+                "latency_mean": sum(latencies) / len(latencies),
+                "queries_per_sec": len(latencies) / seconds,}
+
+
+def get_synthetic_vectors(n: int, size: int, seed: int=0) -> np.ndarray:
+    """
+    Clustered vectors with variance decaying over the dimensions, like embeddings trained to be shortened
+    (text-embedding-3), so the first dimensions keep most of the neighbourhood structure
+    """
+    rng = np.random.default_rng(seed)
+    decay = 1 / np.sqrt(1 + np.arange(size) / 32)
+    centers = rng.standard_normal((max(1, n // 50), size)) * decay
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.5 * rng.standard_normal((n, size)) * decay
+    return vectors.astype(np.float32)
+
+
+def shorten(vectors: np.ndarray, size: int) -> np.ndarray:
+    """
+    First size dimensions of the vectors, normalized (how shortened OpenAI embeddings are made)
+    """
+    vectors = vectors[:, :size]
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class StorageBenchmark:
+    def __init__(self, qdrant_client: QdrantClient, vectors: np.ndarray, n_queries: int=100, k: int=10, wait_indexed: bool=True):
+        """
+        Recall, query latency and estimated RAM of Qdrant storage profiles and shortened embeddings
+        Recall@k is measured against exact cosine search of the full size vectors.
+        Args:
+            qdrant_client: Qdrant server (local mode ignores quantization and HNSW settings)
+            vectors (np.ndarray): embeddings, the last n_queries are used as queries
+            n_queries (int): number of queries
+            k (int): neighbours per query
+            wait_indexed (bool): wait for the HNSW index to be built before querying (server)
+        """
+        self.qdrant_client = qdrant_client
+        self.points = vectors[:-n_queries]
+        self.queries = vectors[-n_queries:]
+        self.k = k
+        self.wait_indexed = wait_indexed
+        self.qdrant_vectorstore = QdrantVectorsManager()
+        points, queries = shorten(self.points, self.points.shape[1]), shorten(self.queries, self.queries.shape[1])
+        self.truth = [set(np.argsort(-scores)[:k].tolist()) for scores in queries @ points.T]
+
+    def estimate_ram_mb(self, storage_profile: str, size: int) -> float:
+        """
+        RAM of vectors and HNSW graph: float32 vectors unless on disk, quantized vectors, 2 * m links per point
+        """
+        profile = STORAGE_PROFILES[storage_profile]
+        n = len(self.points)
+        ram = 0 if profile.get("on_disk") else n * size * 4
+        quantization = profile.get("quantization")
+        if isinstance(quantization, models.ScalarQuantization):
+            ram += n * size
+        elif isinstance(quantization, models.BinaryQuantization):
+            ram += n * ((size + 7) // 8)
+        m = profile["hnsw"].m if profile.get("hnsw") else 16
+        ram += n * m * 2 * 4
+        return ram / 1024 / 1024
+
+    def _wait_indexed(self, collection_name: str, timeout: float=600):
+        start = time.time()
+        while time.time() - start < timeout:
+            info = self.qdrant_client.get_collection(collection_name)
+            if info.status == models.CollectionStatus.GREEN and (info.indexed_vectors_count or 0) >= len(self.points):
+                return
+            time.sleep(1)
+
+    def run_profile(self, storage_profile: str, size: int) -> dict:
+        """
+        Load the vectors shortened to size into a new collection of the profile and run the queries
+        Returns:
+            dict: {profile, dimensions, points, recall, latency_p50, latency_p95, ram_mb, upload_seconds}
+        """
+        collection_name = f"storage_{storage_profile}_{size}_{time.time_ns()}"
+        self.qdrant_vectorstore.create_collection(collection_name, self.qdrant_client, VectorParams(size=size, distance=Distance.COSINE), storage_profile)
+        # Build the HNSW index also for small benchmark collections
+        self.qdrant_client.update_collection(collection_name, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1))
+        points, queries = shorten(self.points, size), shorten(self.queries, size)
+        start = time.perf_counter()
+        for offset in range(0, len(points), 1000):
+            batch = points[offset:offset + 1000]
+            self.qdrant_client.upsert(collection_name, points=models.Batch(ids=list(range(offset, offset + len(batch))), vectors=batch.tolist()), wait=True)
+        if self.wait_indexed:
+            self._wait_indexed(collection_name)
+        upload_seconds = time.perf_counter() - start
+
+        search_params = self.qdrant_vectorstore.get_search_params(storage_profile)
+        latencies, recalls = [], []
+        for query, truth in zip(queries, self.truth):
+            start = time.perf_counter()
+            result = self.qdrant_client.query_points(collection_name, query=query.tolist(), limit=self.k, search_params=search_params)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(truth & {point.id for point in result.points}) / self.k)
+        self.qdrant_client.delete_collection(collection_name)
+        return {"profile": storage_profile,
+                "dimensions": size,
+                "points": len(points),
+                "recall": sum(recalls) / len(recalls),
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p95": percentile(latencies, 0.95),
+                "ram_mb": self.estimate_ram_mb(storage_profile, size),
+                "upload_seconds": upload_seconds,}
+
+
+def run_storage_report(args) -> list:
+    """
+    Recall vs latency vs RAM of every storage profile and embedding size
+    """
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = get_synthetic_vectors(args.points + 100, max(parse_list(args.dimensions)))
+    benchmark = StorageBenchmark(QdrantClient(location=args.qdrant_url), vectors, wait_indexed=args.qdrant_url != ":memory:")
+    results = []
+    for size in parse_list(args.dimensions):
+        for storage_profile in args.profiles.split(","):
+            result = benchmark.run_profile(storage_profile, size)
+            results.append(result)
+            print(f"{storage_profile:>8} {size:>5}d: recall@10 {result['recall']:.3f}, p50 {result['latency_p50'] * 1000:.1f} ms, "
+                  f"p95 {result['latency_p95'] * 1000:.1f} ms, RAM ~{result['ram_mb']:.0f} MB")
+    return results
+
+
+def parse_list(values: str) -> list:
+    return [int(value) for value in values.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of ingestion and query latency")
+    parser.add_argument("--filings", default="1,2,5", help="numbers of filings to ingest")
+    parser.add_argument("--sections", default="5,20", help="numbers of sections per filing")
+    parser.add_argument("--sessions", default="1,4,8", help="numbers of concurrent query sessions")
+    parser.add_argument("--queries", type=int, default=10, help="queries per session")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per stub LLM call")
+    parser.add_argument("--extractor-latency", type=float, default=0.05, help="seconds per fake ExtractorApi call")
+    parser.add_argument("--recordings", help="directory of recorded section text '<item>.txt'")
+    parser.add_argument("--workers", type=int, default=8, help="save_to_vectorstore max_workers")
+    parser.add_argument("--extractor-rate", type=float, default=1000, help="ExtractorApi requests/second rate limit")
+    parser.add_argument("--hybrid", action="store_true", help="use hybrid retrieval")
+    parser.add_argument("--output", default="benchmark_results.json", help="json results file")
+    parser.add_argument("--storage-report", action="store_true", help="compare Qdrant storage profiles instead of ingestion/query")
+    parser.add_argument("--qdrant-url", default="http://localhost:6333", help="Qdrant server of the storage report (':memory:' for a smoke test)")
+    parser.add_argument("--points", type=int, default=20000, help="vectors in each storage report collection")
+    parser.add_argument("--dimensions", default="1536,512", help="embedding sizes of the storage report")
+    parser.add_argument("--profiles", default=",".join(STORAGE_PROFILES), help="storage profiles of the storage report")
+    parser.add_argument("--vectors", help=".npy file of real embeddings for the storage report (synthetic if missing)")
+    args = parser.parse_args()
+    # Local Qdrant ignores payload indexes
+    warnings.filterwarnings("ignore", message="Payload indexes have no effect")
+
+    if args.storage_report:
+        results = {"commit": get_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": vars(args), "storage": run_storage_report(args)}
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+        return
+
+    benchmark = Benchmark(FakeExtractorApi(recordings_dir=args.recordings, latency=args.extractor_latency),
+                          llm_latency=args.llm_latency, hybrid=args.hybrid, workers=args.workers, extractor_rate=args.extractor_rate)
+    results = {"commit": get_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": vars(args), "ingestion": [], "query": []}
+
+    vector_store, largest = None, -1
+    for n_filings in parse_list(args.filings):
+        for n_sections in parse_list(args.sections):
+            result, run_vector_store = benchmark.run_ingestion(n_filings, n_sections)
+            results["ingestion"].append(result)
+            if result["chunks"] > largest:
+                vector_store, largest = run_vector_store, result["chunks"]
+            print(f"ingest {n_filings} filings x {n_sections} sections: {result['seconds']:.2f}s, "
+                  f"{result['sections_per_sec']:.1f} sections/s, {result['chunks_per_sec']:.1f} chunks/s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    # Queries against the largest ingested collection (most chunks)
+    for sessions in parse_list(args.sessions):
+        result = benchmark.run_queries(vector_store, sessions, args.queries)
+        results["query"].append(result)
+        print(f"query {sessions} sessions: p50 {result['latency_p50'] * 1000:.0f} ms, p95 {result['latency_p95'] * 1000:.0f} ms, "
+              f"{result['queries_per_sec']:.1f} queries/s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Headless bulk ingestion of 10-K filings into the shared Qdrant corpus
+
+Example:
+    python bulk_ingest.py --tickers AAPL MSFT NVDA --years 2019-2023 --sections 1A,7 --workers 4
+
+Settings are read from environment variables:
+    NAME, EMAIL                 User-Agent for EDGAR
+    QDRANT_URL, QDRANT_API_KEY  Qdrant server (or --qdrant-path for a local Qdrant)
+    OPENAI_API_KEY              OpenAI embeddings (not needed with --embeddings FastEmbed)
+    SEC_API_KEY                 sec-api ExtractorApi fallback (optional)
+    FASTEMBED_MODEL_DIR         local fastembed model directory (optional)
+"""
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sec_api import ExtractorApi
+from qdrant_client import QdrantClient
+from scraper import Scraper
+from fetchfilings import FetchFilings
+from edgar_client import EdgarClient
+from sectionizer import LocalExtractorApi
+from embedding_cache import CachedEmbeddings
+from embedding_backends import EmbeddingBackend
+from company_directory import CompanyDirectory
+from ingestion_manifest import IngestionManifest
+from section_cache import SectionCache, CachedExtractorApi
+from qdrant_vectors_manager import QdrantVectorsManager, STORAGE_PROFILES
+
+class BulkIngestor:
+    def __init__(self, fetch_filings: FetchFilings, qdrant_vectorstore: QdrantVectorsManager, vector_store, extractorApi,
+                 manifest: IngestionManifest, section_workers: int=8):
+        """
+        Ingest 10-K filings of many companies, resumable from the ingestion manifest
+        Every completed (filing, section) unit is recorded in the manifest, so a resumed run fetches only
+        the units that are missing or failed before.
+        Args:
+            fetch_filings: FetchFilings to list filings of a company
+            qdrant_vectorstore: QdrantVectorsManager to save filings
+            vector_store: Qdrant vector store (shared corpus)
+            extractorApi: section extractor (LocalExtractorApi/CachedExtractorApi/ExtractorApi)
+            manifest: IngestionManifest of the collection
+            section_workers (int): sections fetched in parallel per filing
+        """
+        self.fetch_filings = fetch_filings
+        self.qdrant_vectorstore = qdrant_vectorstore
+        self.vector_store = vector_store
+        self.extractorApi = extractorApi
+        self.manifest = manifest
+        self.section_workers = section_workers
+
+    def ingest_company(self, cik: str, years: tuple, sections: dict, company: str=None, web: bool=False, max_filings: int=50) -> dict:
+        """
+        Ingest 10-K filings of a company filed in the year range
+        Args:
+            cik (str): company cik
+            years (tuple): (first year, last year) of filing dates
+            sections (dict): 10-K sections {item: name} to ingest
+            company (str): 'Apple Inc. (AAPL)', needed for web data
+            web (bool): also ingest stock info and news with Scraper
+            max_filings (int): max number of recent 10-K filings to look at
+        Returns:
+            dict: {filings, sections, skipped, chunks, errors}
+        """
+        stats = {"filings": 0, "sections": 0, "skipped": 0, "chunks": 0, "errors": []}
+        filings = self.fetch_filings.get_recent_filings_10K(cik=cik, count=max_filings)
+        filings = [filing for filing in filings if years[0] <= int(filing['date'][:4]) <= years[1]]
+
+        for filing in filings:
+            skipped = stats["skipped"]
+            errors = self.qdrant_vectorstore.save_to_vectorstore(data=[filing], vector_store=self.vector_store, type_of_data='filings', sections=sections,
+                                                                 extractorApi=self.extractorApi, max_workers=self.section_workers, stats=stats,
+                                                                 manifest=self.manifest)
+            stats["errors"].extend(errors)
+            if stats["skipped"] - skipped < len(sections):
+                stats["filings"] += 1
+
+        if web and company:
+            ticker = company.split('(')[-1].strip(') ')
+            company_name = company.split('(')[0].strip()
+            webscraper = Scraper(ticker=ticker, company_name=company_name)
+            web_data = webscraper.get_web_data(sources=("stock_info", "news_gglnews"))
+            self.qdrant_vectorstore.save_to_vectorstore(data=web_data, vector_store=self.vector_store, type_of_data='web', cik=cik)
+        return stats
+
+    def run(self, companies: dict, years: tuple, sections: dict, workers: int=4, web: bool=False) -> dict:
+        """
+        Ingest companies on a thread pool and summarize throughput
+        Args:
+            companies (dict): {cik: company name or None}
+            years (tuple): (first year, last year) of filing dates
+            sections (dict): 10-K sections {item: name} to ingest
+            workers (int): companies ingested in parallel
+            web (bool): also ingest stock info and news
+        Returns:
+            dict: {companies, filings, sections, skipped, chunks, errors, seconds, filings_per_min, chunks_per_sec}
+        """
+        start = time.perf_counter()
+        summary = {"companies": 0, "filings": 0, "sections": 0, "skipped": 0, "chunks": 0, "errors": []}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.ingest_company, cik, years, sections, company, web): cik for cik, company in companies.items()}
+            for future in as_completed(futures):
+                cik = futures[future]
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    summary["errors"].append({"cik": cik, "stage": "company", "error": str(e)})
+                    continue
+                summary["companies"] += 1
+                for key in ("filings", "sections", "skipped", "chunks"):
+                    summary[key] += stats[key]
+                summary["errors"].extend(stats["errors"])
+                print(f"{companies[cik] or cik}: {stats['filings']} filings, {stats['sections']} sections, {stats['chunks']} chunks, {len(stats['errors'])} errors")
+
+        seconds = time.perf_counter() - start
+        summary["seconds"] = seconds
+        summary["filings_per_min"] = summary["filings"] / seconds * 60 if seconds else 0.0
+        summary["chunks_per_sec"] = summary["chunks"] / seconds if seconds else 0.0
+        return summary
+
+
+def parse_years(years: str) -> tuple:
+    """
+    '2019-2023' -> (2019, 2023), '2023' -> (2023, 2023)
+    """
+    first, _, last = years.partition("-")
+    return int(first), int(last or first)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingest 10-K filings into the shared Qdrant corpus")
+    parser.add_argument("--tickers", nargs="*", default=[], help="company tickers (AAPL MSFT ...)")
+    parser.add_argument("--ciks", nargs="*", default=[], help="company CIKs")
+    parser.add_argument("--tickers-file", help="file with one ticker or CIK per line")
+    parser.add_argument("--years", default="2019-2024", help="filing year range, e.g. 2019-2023")
+    parser.add_argument("--sections", default="all", help="comma separated 10-K items, e.g. 1A,7 (default all)")
+    parser.add_argument("--workers", type=int, default=4, help="companies ingested in parallel")
+    parser.add_argument("--section-workers", type=int, default=8, help="sections fetched in parallel per filing")
+    parser.add_argument("--manifest", default=".cache/ingestion_manifest.sqlite", help="ingestion manifest of completed and failed units")
+    parser.add_argument("--collection", default="sec_filings_10k", help="shared collection name")
+    parser.add_argument("--embeddings", default="OpenAI", choices=["OpenAI", "FastEmbed"], help="embedding backend")
+    parser.add_argument("--dimensions", type=int, help="shortened OpenAI embedding size, e.g. 512")
+    parser.add_argument("--storage-profile", default="default", choices=list(STORAGE_PROFILES), help="Qdrant storage of a new collection")
+    parser.add_argument("--qdrant-path", help="local Qdrant storage path instead of QDRANT_URL")
+    parser.add_argument("--web", action="store_true", help="also ingest stock info and news")
+    args = parser.parse_args()
+
+    headers = {"User-Agent": f"{os.environ['NAME']} {os.environ['EMAIL']}",}
+    edgar_client = EdgarClient(headers)
+    fetch_filings = FetchFilings(headers, client=edgar_client)
+    company_directory = CompanyDirectory(headers, client=edgar_client)
+
+    all_sections = fetch_filings.get_sections_10K()
+    items = list(all_sections) if args.sections == "all" else [item.strip() for item in args.sections.upper().split(",") if item.strip()]
+    unknown = [item for item in items if item not in all_sections]
+    if unknown:
+        parser.error(f"unknown sections {', '.join(unknown)} in --sections, valid items: {','.join(all_sections)}")
+    sections = {item: all_sections[item] for item in items}
+
+    # Resolve tickers and CIKs to {cik: company}
+    identifiers = list(args.tickers) + list(args.ciks)
+    if args.tickers_file:
+        with open(args.tickers_file, "r") as f:
+            identifiers.extend(line.strip() for line in f if line.strip())
+    companies = {}
+    for identifier in identifiers:
+        matches = company_directory.search(identifier, limit=1)
+        if identifier.isdigit():
+            companies[identifier.zfill(10)] = matches[0] if matches else None
+        elif matches and matches[0].endswith(f"({identifier.upper()})"):
+            companies[company_directory.get_cik(matches[0])] = matches[0]
+        else:
+            print(f"Unknown company: {identifier}")
+
+    # Vector store
+    qdrant_vectorstore = QdrantVectorsManager()
+    qdrant_client = QdrantClient(path=args.qdrant_path) if args.qdrant_path else QdrantClient(url=os.environ["QDRANT_URL"], api_key=os.environ.get("QDRANT_API_KEY"))
+    model_name = "text-embedding-3-small" if args.embeddings == "OpenAI" else "BAAI/bge-small-en-v1.5"
+    embeddings, vector_params, namespace = EmbeddingBackend().get_embeddings(provider=args.embeddings, api_key=os.environ.get("OPENAI_API_KEY"),
+                                                                               model_name=model_name, model_dir=os.environ.get("FASTEMBED_MODEL_DIR"),
+                                                                               dimensions=args.dimensions)
+    vector_store = qdrant_vectorstore.initialize_shared_vectorstore(collection_name=qdrant_vectorstore.get_shared_collection_name(args.collection, namespace),
+                                                                    qdrant_client=qdrant_client, embeddings=CachedEmbeddings(embeddings, namespace=namespace),
+                                                                    vector_params=vector_params, storage_profile=args.storage_profile)
+
+    # Extractor: local sectionizer, sec-api fallback, section cache
+    fallback = ExtractorApi(os.environ["SEC_API_KEY"]) if os.environ.get("SEC_API_KEY") else None
+    extractorApi = CachedExtractorApi(LocalExtractorApi(headers, fallback=fallback, client=edgar_client), SectionCache())
+
+    ingestor = BulkIngestor(fetch_filings, qdrant_vectorstore, vector_store, extractorApi, IngestionManifest(args.manifest), section_workers=args.section_workers)
+    summary = ingestor.run(companies, parse_years(args.years), sections, workers=args.workers, web=args.web)
+
+    print(f"\n{summary['companies']} companies, {summary['filings']} filings, {summary['sections']} sections "
+          f"({summary['skipped']} already done), {summary['chunks']} chunks in {summary['seconds']:.1f}s")
+    print(f"Throughput: {summary['filings_per_min']:.1f} filings/min, {summary['chunks_per_sec']:.1f} chunks/sec")
+    for error in summary["errors"]:
+        print(f"Error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import re
+from typing import Iterable, Iterator, Union
+from context_packer import count_tokens
+
+# Numbers of financial tables: 1,234  (1,234)  12.5%  $  —
+NUMERIC_TOKEN = re.compile(r"^(\(?\$?\d[\d,]*(\.\d+)?\)?%?|\$|%|—|–|-)$")
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+def iter_lines(text: Union[str, Iterable[str]]) -> Iterator[str]:
+    """
+    Lines of a text or of a stream of text pieces, without holding a list of all lines
+    """
+    if isinstance(text, str):
+        start = 0
+        while start < len(text):
+            end = text.find("\n", start)
+            end = len(text) if end == -1 else end
+            yield text[start:end]
+            start = end + 1
+        return
+    rest = ""
+    for piece in text:
+        lines = (rest + piece).split("\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+class SectionChunker:
+    def __init__(self, max_tokens: int=400, table_max_tokens: int=800, min_tokens: int=100):
+        """
+        Streaming chunker for 10-K section text (one paragraph, heading or table row per line)
+        Chunks are cut on paragraph and heading boundaries and sized by tokens (context_packer.count_tokens).
+        Tables (runs of lines that are mostly numbers) are kept whole in one chunk up to table_max_tokens,
+        larger tables are split by rows with the header row repeated in every chunk.
+        Paragraphs longer than max_tokens are split on sentences.
+        Args:
+            max_tokens (int): max tokens of a text chunk
+            table_max_tokens (int): max tokens of a table kept whole
+            min_tokens (int): a heading starts a new chunk once the current chunk has this many tokens
+        """
+        self.max_tokens = max_tokens
+        self.table_max_tokens = table_max_tokens
+        self.min_tokens = min_tokens
+
+    def is_table_row(self, line: str) -> bool:
+        """
+        Whether a line is a table row: at least 2 numbers that make up at least 30% of its words, and not a sentence
+            'Net sales $ 383,285 $ 394,328 $ 365,817' -> True
+        """
+        words = line.split()
+        numbers = sum(1 for word in words if NUMERIC_TOKEN.match(word))
+        return numbers >= 2 and numbers >= 0.3 * len(words) and len(line) < 400 and not line.endswith(".")
+
+    def is_heading(self, line: str) -> bool:
+        """
+        Whether a line is a heading: short, capitalized and not a sentence ('Segment Operating Performance', 'Item 7. ...')
+        """
+        return len(line) <= 100 and len(line.split()) <= 12 and line[0].isupper() and not line.endswith((",", ";", ":")) \
+            and (not line.endswith(".") or line.lower().startswith("item"))
+
+    def blocks(self, lines: Iterable[str]) -> Iterator[tuple]:
+        """
+        Group lines into blocks: ("heading", line), ("text", paragraph) or ("table", rows joined by new lines)
+        Up to 2 short label lines between table rows ('Americas', 'Operating expenses:') stay in the table.
+        """
+        table, labels = [], []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if self.is_table_row(line):
+                if table:
+                    table.extend(labels)
+                else:
+                    for label in labels:
+                        yield ("heading" if self.is_heading(label) else "text"), label
+                labels = []
+                table.append(line)
+            elif table and len(line) <= 80 and not line.endswith(".") and len(labels) < 2:
+                labels.append(line)
+            else:
+                if table:
+                    yield ("table" if len(table) > 1 else "text"), "\n".join(table)
+                    table = []
+                for label in labels + [line]:
+                    yield ("heading" if self.is_heading(label) else "text"), label
+                labels = []
+        if table:
+            yield ("table" if len(table) > 1 else "text"), "\n".join(table)
+        for label in labels:
+            yield ("heading" if self.is_heading(label) else "text"), label
+
+    def _split_long(self, text: str) -> Iterator[str]:
+        """
+        Pieces of at most max_tokens of a text, cut between words (between characters for a single longer word, e.g. a url)
+        """
+        tokens = count_tokens(text)
+        if tokens <= self.max_tokens:
+            yield text
+            return
+        words = text.split()
+        if len(words) > 1:
+            step = max(1, len(words) * self.max_tokens // tokens)
+            for i in range(0, len(words), step):
+                yield from self._split_long(" ".join(words[i:i + step]))
+        else:
+            step = max(1, len(text) * self.max_tokens // tokens)
+            for i in range(0, len(text), step):
+                yield from self._split_long(text[i:i + step])
+
+    def _split_text(self, text: str) -> Iterator[str]:
+        """
+        Pieces of max_tokens of a long paragraph, cut between sentences (between words for longer sentences)
+        """
+        piece, used = [], 0
+        for sentence in SENTENCE_END.split(text):
+            tokens = count_tokens(sentence)
+            sentences = self._split_long(sentence) if tokens > self.max_tokens else [sentence]
+            for sentence in sentences:
+                tokens = count_tokens(sentence)
+                if piece and used + tokens > self.max_tokens:
+                    yield " ".join(piece)
+                    piece, used = [], 0
+                piece.append(sentence)
+                used += tokens
+        if piece:
+            yield " ".join(piece)
+
+    def _split_table(self, table: str) -> Iterator[str]:
+        """
+        Pieces of max_tokens of a large table, every piece starts with the header row
+        """
+        rows = table.split("\n")
+        header, header_tokens = rows[0], count_tokens(rows[0])
+        piece, used = [header], header_tokens
+        for row in rows[1:]:
+            tokens = count_tokens(row)
+            if len(piece) > 1 and used + tokens > self.max_tokens:
+                yield "\n".join(piece)
+                piece, used = [header], header_tokens
+            piece.append(row)
+            used += tokens
+        if len(piece) > 1:
+            yield "\n".join(piece)
+
+    def chunks(self, text: Union[str, Iterable[str]]) -> Iterator[tuple]:
+        """
+        Chunks of a section, generated as the text is read
+        Args:
+            text (str | Iterable[str]): section text or a stream of pieces of it
+        Yields:
+            tuple: (chunk text, 'text' or 'table')
+        """
+        parts, used, has_table, last_kind = [], 0, False, None
+        for kind, block in self.blocks(iter_lines(text)):
+            tokens = count_tokens(block)
+            if kind == "heading" and used >= self.min_tokens:
+                yield "\n".join(parts), "table" if has_table else "text"
+                parts, used, has_table = [], 0, False
+            if (kind == "table" and tokens > self.max_tokens) or (kind == "text" and tokens > self.max_tokens) or used + tokens > self.max_tokens:
+                # A caption ('... (in millions):') or heading moves with its table
+                caption = parts.pop() if kind == "table" and parts and (parts[-1].endswith(":") or last_kind == "heading") else None
+                if parts:
+                    yield "\n".join(parts), "table" if has_table else "text"
+                parts, used, has_table = [], 0, False
+                if caption:
+                    parts, used = [caption], count_tokens(caption)
+            if kind == "table" and used + tokens > self.table_max_tokens:
+                for piece in self._split_table(block):
+                    yield "\n".join(parts + [piece]), "table"
+                    parts, used = [], 0
+                continue
+            if kind == "table" and used + tokens > self.max_tokens:
+                yield "\n".join(parts + [block]), "table"
+                parts, used = [], 0
+                continue
+            if kind == "text" and tokens > self.max_tokens:
+                pieces = list(self._split_text(block))
+                for piece in pieces[:-1]:
+                    yield piece, "text"
+                block, tokens = pieces[-1], count_tokens(pieces[-1])
+            parts.append(block)
+            used += tokens
+            has_table |= kind == "table"
+            last_kind = kind
+        if parts:
+            yield "\n".join(parts), "table" if has_table else "text"
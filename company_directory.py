@@ -0,0 +1,104 @@
+import time
+import bisect
+import threading
+from tracing import tracer
+from edgar_client import EdgarClient
+
+class CompanyDirectory:
+    def __init__(self, headers: dict, ttl: float=24 * 60 * 60, client: EdgarClient=None):
+        """
+        Directory of companies listed in "https://www.sec.gov/files/company_tickers.json"
+        The file is kept in the EDGAR client's json cache (EdgarClient.get_json) and refreshed with a conditional request
+        (ETag/Last-Modified) after ttl. Lookups by ticker, cik or partial name are served from in-memory indexes.
+        Args:
+            headers (dict): headers for request to sec.gov
+            ttl (float): seconds before the cached copy is revalidated
+            client (EdgarClient): shared EDGAR http client, created from headers if not provided
+        """
+        self.url = "https://www.sec.gov/files/company_tickers.json"
+        self.headers = headers
+        self.ttl = ttl
+        self.client = client or EdgarClient(headers)
+        self.lock = threading.Lock()
+        self.loaded_at = 0
+        self.companies = {}
+        self.by_ticker = {}
+        self.by_cik = {}
+        self.tickers = []
+        self.names = []
+        self.words = []
+
+    def load(self, force: bool=False):
+        """
+        Load directory through the EDGAR client's json cache, revalidating it with sec.gov if older than ttl, and rebuild indexes
+        """
+        with self.lock:
+            if not force and self.companies and time.time() - self.loaded_at < self.ttl:
+                return
+            with tracer.span("edgar.load_company_directory") as span:
+                data = self.client.get_json(self.url, cache=True, max_age=0 if force else self.ttl)
+                self._build_index(data)
+                span["companies"] = len(self.companies)
+            self.loaded_at = time.time()
+
+    def _build_index(self, data: dict):
+        """
+        Build lookup indexes from raw company_tickers.json
+            companies: {'Apple Inc. (AAPL)': '0000320193'}
+            by_ticker: {'AAPL': 'Apple Inc. (AAPL)'}, by_cik: {'0000320193': ['Apple Inc. (AAPL)']}
+            tickers, names, words: sorted (prefix key, company) lists for bisect prefix search
+        """
+        companies, by_ticker, by_cik = {}, {}, {}
+        tickers, names, words = [], [], []
+        for val in data.values():
+            company = f"{val['title']} ({val['ticker']})"
+            cik = str(val['cik_str']).zfill(10)
+            companies[company] = cik
+            by_ticker.setdefault(val['ticker'].upper(), company)
+            by_cik.setdefault(cik, []).append(company)
+            tickers.append((val['ticker'].upper(), company))
+            names.append((val['title'].lower(), company))
+            words.extend((word, company) for word in val['title'].lower().split()[1:])
+        self.companies, self.by_ticker, self.by_cik = companies, by_ticker, by_cik
+        self.tickers, self.names, self.words = sorted(tickers), sorted(names), sorted(words)
+
+    def _prefix_matches(self, index: list, prefix: str, limit: int) -> list:
+        start = bisect.bisect_left(index, (prefix,))
+        matches = []
+        for key, company in index[start:]:
+            if not key.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append(company)
+        return matches
+
+    def search(self, query: str, limit: int=20) -> list:
+        """
+        Find companies by ticker, cik or partial name
+        Exact ticker/cik matches come first, then ticker prefixes, name prefixes and word prefixes of names
+        Args:
+            query (str): 'AAPL', '320193', 'apple', 'micro'
+            limit (int): max number of companies returned
+        Returns:
+            list[str]: matching companies as 'Apple Inc. (AAPL)'
+        """
+        self.load()
+        query = query.strip()
+        if not query:
+            return []
+
+        matches = []
+        if query.isdigit():
+            matches.extend(self.by_cik.get(query.zfill(10), []))
+        if query.upper() in self.by_ticker:
+            matches.append(self.by_ticker[query.upper()])
+        matches.extend(self._prefix_matches(self.tickers, query.upper(), limit))
+        matches.extend(self._prefix_matches(self.names, query.lower(), limit))
+        matches.extend(self._prefix_matches(self.words, query.lower(), limit))
+        return list(dict.fromkeys(matches))[:limit]
+
+    def get_cik(self, company: str) -> str:
+        """
+        Get cik of a company ('Apple Inc. (AAPL)' -> '0000320193')
+        """
+        self.load()
+        return self.companies[company]
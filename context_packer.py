@@ -0,0 +1,153 @@
+import re
+from tracing import tracer
+from langchain_core.documents import Document
+from hybrid_retriever import tokenize
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate number of LLM tokens of text (works offline for any provider)
+    Every word, number and punctuation mark is a token, long words are split every 8 characters.
+    """
+    return sum(1 + len(piece) // 8 for piece in re.findall(r"\w+|[^\w\s]", text))
+
+
+class ContextPacker:
+    def __init__(self, max_tokens: int=3000, lambda_mult: float=0.7, max_overlap: int=300, min_overlap: int=20):
+        """
+        Assemble retrieved chunks into the LLM context within a token budget
+            1. Adjacent chunks of the same filing section (consecutive chunk_id) are merged and their overlap removed
+            2. Maximal marginal relevance orders them by retrieval rank penalized by word overlap with the chunks already
+               selected, so near duplicate passages (e.g. the same risk factor in consecutive years' 10-Ks) go last
+            3. Chunks are packed in that order until max_tokens is used
+        Args:
+            max_tokens (int): token budget of the retrieved context
+            lambda_mult (float): 1 = retrieval order only, 0 = max diversity
+            max_overlap (int): max characters of overlap between adjacent chunks (news chunks overlap by 150, SectionChunker chunks do not overlap)
+            min_overlap (int): min characters of a suffix/prefix match to be treated as overlap
+        """
+        self.max_tokens = max_tokens
+        self.lambda_mult = lambda_mult
+        self.max_overlap = max_overlap
+        self.min_overlap = min_overlap
+
+    def _strip_overlap(self, text: str, next_text: str) -> str:
+        """
+        next_text without its prefix repeating the end of text
+        """
+        for size in range(min(self.max_overlap, len(text), len(next_text)), self.min_overlap - 1, -1):
+            if text.endswith(next_text[:size]):
+                return next_text[size:]
+        return next_text
+
+    def merge_adjacent(self, documents: list) -> list:
+        """
+        Merge chunks with consecutive chunk_id of the same filing section, keeping the rank of the best ranked chunk
+        Web chunks are merged only within one source (metadata source), chunks of different news sources are separate documents.
+        Returns:
+            list[Document]: merged documents in retrieval order, chunk_id of merged chunks is a range ('3-5')
+        """
+        groups = {}
+        for rank, document in enumerate(documents):
+            metadata = document.metadata
+            if not str(metadata.get("chunk_id", "")).isdigit() or not (metadata.get("accession") or metadata.get("source")):
+                groups[("rank", rank)] = [(rank, None, document)]
+                continue
+            key = (metadata.get("accession") or metadata.get("source"), metadata.get("section") or metadata.get("details"), metadata.get("cik"))
+            groups.setdefault(key, []).append((rank, int(metadata["chunk_id"]), document))
+
+        merged = []
+        for chunks in groups.values():
+            chunks.sort(key=lambda chunk: -1 if chunk[1] is None else chunk[1])
+            run = [chunks[0]]
+            for chunk in chunks[1:] + [None]:
+                if chunk is not None and run[-1][1] is not None and chunk[1] == run[-1][1] + 1:
+                    run.append(chunk)
+                    continue
+                text = run[0][2].page_content
+                for _, _, document in run[1:]:
+                    rest = self._strip_overlap(text, document.page_content)
+                    # Chunks split on a paragraph boundary have no overlap
+                    text += rest if len(rest) < len(document.page_content) else "\n\n" + rest
+                metadata = dict(run[0][2].metadata)
+                if len(run) > 1:
+                    metadata["chunk_id"] = f"{run[0][1]}-{run[-1][1]}"
+                merged.append((min(rank for rank, _, _ in run), Document(page_content=text, metadata=metadata)))
+                run = [chunk]
+        return [document for _, document in sorted(merged, key=lambda item: item[0])]
+
+    def mmr(self, documents: list) -> list:
+        """
+        Order documents by maximal marginal relevance, relevance from retrieval rank and similarity from word overlap (Jaccard)
+        """
+        tokens = [set(tokenize(document.page_content)) for document in documents]
+        relevance = [1 / (rank + 1) for rank in range(len(documents))]
+        selected, remaining = [], list(range(len(documents)))
+        while remaining:
+            def score(i):
+                similarity = max((len(tokens[i] & tokens[j]) / (len(tokens[i] | tokens[j]) or 1) for j in selected), default=0)
+                return self.lambda_mult * relevance[i] - (1 - self.lambda_mult) * similarity
+            best = max(remaining, key=score)
+            selected.append(best)
+            remaining.remove(best)
+        return [documents[i] for i in selected]
+
+    def _fit(self, documents: list, max_tokens: int, truncate: bool=True) -> tuple:
+        """
+        Documents in order that fit in max_tokens, smaller ones are taken when a document does not fit
+        The first document is truncated if it alone exceeds the budget (truncate)
+        Returns:
+            tuple: (list[Document], tokens used, set of ids of the input documents packed whole or truncated)
+        """
+        packed, used, consumed = [], 0, set()
+        for document in documents:
+            tokens = count_tokens(document.page_content)
+            if used + tokens <= max_tokens:
+                packed.append(document)
+                used += tokens
+                consumed.add(id(document))
+            elif not packed and truncate:
+                text = document.page_content[:int(len(document.page_content) * max_tokens / tokens)]
+                packed.append(Document(page_content=text, metadata=document.metadata))
+                used += count_tokens(text)
+                consumed.add(id(document))
+        return packed, used, consumed
+
+    def _round_robin(self, groups: list) -> list:
+        """
+        Documents of several lists interleaved by rank
+        """
+        return [documents[rank] for rank in range(max(map(len, groups), default=0)) for documents in groups if rank < len(documents)]
+
+    def pack(self, documents: list) -> list:
+        """
+        Merge, diversify and pack retrieved documents to the token budget
+        Documents that do not fit are skipped for smaller ones, the first document is truncated if it alone exceeds the budget
+        Documents of several companies (metadata company, FanOutRetriever) are packed to an equal share of the budget per company
+        and interleaved round-robin, the shares a company does not use go to the remaining documents in the same order.
+        Args:
+            documents (list[Document]): retrieved documents, best first
+        Returns:
+            list[Document]: documents for the prompt
+        """
+        with tracer.span("context.pack", documents=len(documents)) as span:
+            tokens_in = sum(count_tokens(document.page_content) for document in documents)
+            ordered = self.mmr(self.merge_adjacent(documents))
+            companies = {}
+            for document in ordered:
+                companies.setdefault(document.metadata.get("company"), []).append(document)
+            if len(companies) > 1:
+                share = self.max_tokens // len(companies)
+                fitted = [self._fit(company_documents, share) for company_documents in companies.values()]
+                packed = self._round_robin([company_packed for company_packed, _, _ in fitted])
+                used = sum(company_used for _, company_used, _ in fitted)
+                # Truncated documents are new Documents, their originals are excluded from the rest too
+                consumed = set().union(*(company_consumed for _, _, company_consumed in fitted))
+                rest = self._round_robin([[document for document in company_documents if id(document) not in consumed] for company_documents in companies.values()])
+                extra, extra_used, _ = self._fit(rest, self.max_tokens - used, truncate=False)
+                packed, used = packed + extra, used + extra_used
+                span["companies"] = len(companies)
+            else:
+                packed, used, _ = self._fit(ordered, self.max_tokens)
+            span.update({"tokens_in": tokens_in, "tokens_out": used, "packed": len(packed)})
+        tracer.count("context.tokens_saved", tokens_in - used)
+        return packed
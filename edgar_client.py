@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import requests
+from collections import deque
+from requests.adapters import HTTPAdapter
+from tracing import tracer
+from ratelimiter import RateLimiter
+
+class EdgarClient:
+    # Statuses worth retrying: rate limited or temporarily unavailable
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: dict, rate: float=10, max_retries: int=4, backoff: float=0.5, timeout: float=30,
+                 pool_size: int=16, cache_dir: str=".cache/edgar", cache_max_age: float=10 * 60):
+        """
+        HTTP client shared by everything that talks to sec.gov / data.sec.gov
+        Keep-alive connection pool, token bucket limiter under SEC fair access limit (10 requests/second for all hosts),
+        retries with exponential backoff and jitter, and an on-disk json cache with conditional revalidation.
+        Args:
+            headers (dict): headers for every request (User-Agent required by EDGAR)
+            rate (float): max requests per second to SEC
+            max_retries (int): retries for connection errors and 429/5xx responses
+            backoff (float): base seconds of exponential backoff (backoff * 2^attempt + jitter)
+            timeout (float): request timeout in seconds
+            pool_size (int): max keep-alive connections per host
+            cache_dir (str): directory for cached json responses
+            cache_max_age (float): seconds a cached response is used without revalidation
+        """
+        self.headers = headers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_max_age = cache_max_age
+        self.rate_limiter = RateLimiter.for_host("sec.gov", rate=rate)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "retries": 0, "errors": 0, "cache_hits": 0, "not_modified": 0, "stale": 0}
+        self.statuses = {}
+        self.latencies = deque(maxlen=1000)
+
+    def get(self, url: str, headers: dict=None, stream: bool=False) -> requests.Response:
+        """
+        GET url with rate limiting and retries
+        Args:
+            url (str): url on sec.gov / data.sec.gov
+            headers (dict): extra headers for this request (e.g. If-None-Match)
+            stream (bool): do not download the body immediately
+        Returns:
+            requests.Response: last response (may still be 429/5xx after all retries)
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(start, None)
+                if attempt == self.max_retries:
+                    raise
+                self._sleep(attempt)
+                continue
+
+            self._record(start, response.status_code)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            response.close()
+            retry_after = response.headers.get("Retry-After")
+            self._sleep(attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+    def _sleep(self, attempt: int, delay: float=None):
+        with self.lock:
+            self.counts["retries"] += 1
+        delay = delay if delay is not None else self.backoff * 2 ** attempt
+        time.sleep(delay + random.uniform(0, self.backoff))
+
+    def _record(self, start: float, status: int):
+        tracer.count("edgar.requests")
+        with self.lock:
+            self.counts["requests"] += 1
+            self.latencies.append(time.perf_counter() - start)
+            if status is None or status >= 400:
+                self.counts["errors"] += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def get_json(self, url: str, cache: bool=False, max_age: float=None) -> dict:
+        """
+        GET json from url, optionally through the on-disk cache
+        Cached responses younger than max_age are used as is, older ones are revalidated
+        with If-None-Match/If-Modified-Since and reused on 304 Not Modified, or when revalidation fails.
+        Args:
+            url (str): json url ('https://data.sec.gov/submissions/CIK0000320193.json')
+            cache (bool): use the on-disk cache
+            max_age (float): seconds a cached response is used without revalidation, cache_max_age if None
+        Returns:
+            dict: parsed json
+        Raises:
+            requests.HTTPError: if response is not successful (and nothing is cached)
+        """
+        if not cache:
+            response = self.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        key = hashlib.sha256(url.encode()).hexdigest()
+        body_path = os.path.join(self.cache_dir, f"{key}.json")
+        meta_path = os.path.join(self.cache_dir, f"{key}.meta")
+        if os.path.exists(body_path) and os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if time.time() - meta["fetched_at"] < (self.cache_max_age if max_age is None else max_age):
+                with self.lock:
+                    self.counts["cache_hits"] += 1
+                with open(body_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        else:
+            meta = {}
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            response = self.get(url, headers=headers)
+        except requests.RequestException:
+            if not meta:
+                raise
+            response = None
+
+        if response is None or response.status_code == 304 or (response.status_code != 200 and meta):
+            # Not modified, or sec.gov unavailable: the cached copy is used and revalidated again after max_age
+            with self.lock:
+                self.counts["not_modified" if response is not None and response.status_code == 304 else "stale"] += 1
+            with open(body_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        else:
+            response.raise_for_status()
+            data = response.json()
+            with open(body_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            meta = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+        meta["fetched_at"] = time.time()
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        return data
+
+    def metrics(self) -> dict:
+        """
+        Request metrics
+        Returns:
+            dict: {requests, retries, errors, cache_hits, not_modified, stale, statuses, latency_avg, latency_p50, latency_p95, latency_max}
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = dict(self.counts)
+            metrics["statuses"] = dict(self.statuses)
+        if latencies:
+            metrics.update({"latency_avg": sum(latencies) / len(latencies),
+                            "latency_p50": latencies[len(latencies) // 2],
+                            "latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                            "latency_max": latencies[-1],})
+        return metrics
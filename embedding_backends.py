@@ -0,0 +1,71 @@
+from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
+from qdrant_client.http.models import Distance, VectorParams
+
+# Output dimension of OpenAI embedding models
+OPENAI_EMBEDDING_SIZES = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
+
+class FastEmbedEmbeddings(Embeddings):
+    def __init__(self, model_name: str="BAAI/bge-small-en-v1.5", model_dir: str=None, threads: int=None, batch_size: int=256, parallel: int=None):
+        """
+        Local ONNX embedding model on CPU with fastembed, no network calls once the model is on disk
+        Args:
+            model_name (str): fastembed model name
+            model_dir (str): directory with the downloaded model, loaded without network access (air-gapped)
+            threads (int): onnxruntime threads per model
+            batch_size (int): texts per inference batch
+            parallel (int): data parallel worker processes for large inputs (0 = all cores, None = single process)
+        """
+        # Imported here so onnxruntime is loaded only when the local backend is used
+        from fastembed import TextEmbedding
+        kwargs = {"local_files_only": True} if model_dir else {}
+        self.model = TextEmbedding(model_name=model_name, cache_dir=model_dir, threads=threads, **kwargs)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.parallel = parallel
+
+    def get_size(self) -> int:
+        """
+        Output dimension of the model
+        """
+        for model in self.model.list_supported_models():
+            if model["model"].lower() == self.model_name.lower():
+                return model["dim"]
+        return len(self.embed_query("dimension"))
+
+    def embed_documents(self, texts: list) -> list:
+        return [vector.tolist() for vector in self.model.embed(texts, batch_size=self.batch_size, parallel=self.parallel)]
+
+    def embed_query(self, text: str) -> list:
+        return next(iter(self.model.query_embed(text))).tolist()
+
+
+class EmbeddingBackend:
+
+    def get_embeddings(self, provider: str, api_key: str=None, model_name: str=None, model_dir: str=None, threads: int=None, dimensions: int=None):
+        """
+        Get embedding model and the matching Qdrant vector config
+        Args:
+            provider: ['openai', 'fastembed']
+            api_key: api key of openai
+            model_name: embedding model (default 'text-embedding-3-small' / 'BAAI/bge-small-en-v1.5')
+            model_dir: local directory of the fastembed model (offline)
+            threads: onnxruntime threads (fastembed)
+            dimensions: shortened output size of text-embedding-3 models (openai), e.g. 512 for 3x smaller vectors
+        Returns:
+            tuple: (embeddings, VectorParams(size, distance), namespace 'provider:model_name' or 'provider:model_name@dimensions')
+        """
+        if provider.lower() == 'openai':
+            model_name = model_name or "text-embedding-3-small"
+            if dimensions and model_name.startswith("text-embedding-3"):
+                embeddings = OpenAIEmbeddings(model=model_name, openai_api_key=api_key, dimensions=dimensions)
+                return embeddings, VectorParams(size=dimensions, distance=Distance.COSINE), f"openai:{model_name}@{dimensions}"
+            embeddings = OpenAIEmbeddings(model=model_name, openai_api_key=api_key)
+            size = OPENAI_EMBEDDING_SIZES[model_name]
+        elif provider.lower() == 'fastembed':
+            model_name = model_name or "BAAI/bge-small-en-v1.5"
+            embeddings = FastEmbedEmbeddings(model_name=model_name, model_dir=model_dir, threads=threads)
+            size = embeddings.get_size()
+        else:
+            raise ValueError(f"Unknown embedding provider: {provider}")
+        return embeddings, VectorParams(size=size, distance=Distance.COSINE), f"{provider.lower()}:{model_name}"
@@ -0,0 +1,127 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from tracing import tracer
+from langchain_core.embeddings import Embeddings
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, namespace: str, cache_path: str=".cache/embeddings.sqlite",
+                 max_entries: int=500_000, dtype: str="float16", batch_size: int=1000):
+        """
+        Embeddings with a local content addressed cache of vectors
+        Each text is looked up by sha256 of (namespace, text), only the misses are embedded,
+        deduplicated and sent in batches of batch_size. Vectors are stored as compact float16/float32
+        blobs in sqlite and evicted least recently used first over max_entries.
+        Args:
+            embeddings: embedding model to use for cache misses (OpenAIEmbeddings, ...)
+            namespace (str): model identity, vectors of different models/dimensions never mix ('text-embedding-3-small')
+            cache_path (str): sqlite file to store vectors
+            max_entries (int): max number of vectors in the cache
+            dtype (str): 'float16' or 'float32' storage of vectors
+            batch_size (int): max texts per embedding request
+        """
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, dtype TEXT, vector BLOB, last_used REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        self.connection.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        """
+        Get cached vectors {key: vector} for the keys and mark them as used
+        """
+        found = {}
+        now = time.time()
+        with self.lock:
+            # sqlite limits number of query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.connection.execute(f"SELECT key, dtype, vector FROM vectors WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+                for key, dtype, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=dtype).astype(np.float32).tolist()
+            self.connection.executemany("UPDATE vectors SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.connection.commit()
+        return found
+
+    def _store(self, vectors: dict):
+        """
+        Save {key: vector} to the cache and evict least recently used vectors over max_entries
+        """
+        now = time.time()
+        rows = [(key, self.dtype.name, np.asarray(vector, dtype=self.dtype).tobytes(), now) for key, vector in vectors.items()]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)", rows)
+            count = self.connection.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute("DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+            self.connection.commit()
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Embed texts, serving cached vectors and embedding only the misses in batches
+        """
+        keys = [self._key(text) for text in texts]
+        vectors = self._lookup(list(set(keys)))
+
+        # Unique missing texts
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        with self.lock:
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += len(missing)
+
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            with tracer.span("embed.documents", texts=len(batch_keys)):
+                new_vectors = dict(zip(batch_keys, self.embeddings.embed_documents([missing[key] for key in batch_keys])))
+            tracer.count("embeddings.api_calls")
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        """
+        Embed query, cached same as documents
+        """
+        key = self._key(f"query\x00{text}")
+        vectors = self._lookup([key])
+        if key in vectors:
+            with self.lock:
+                self.hits += 1
+            return vectors[key]
+        with self.lock:
+            self.misses += 1
+        with tracer.span("embed.query"):
+            vector = self.embeddings.embed_query(text)
+        tracer.count("embeddings.api_calls")
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> dict:
+        """
+        Cache statistics
+        Returns:
+            dict: {hits, misses, hit_rate, entries}
+        """
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "entries": entries}
@@ -0,0 +1,61 @@
+import re
+from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from tracing import tracer
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+# Words of company names too generic to identify a company in a question
+GENERIC_NAME_WORDS = {"inc", "corp", "corporation", "co", "company", "ltd", "plc", "the", "group", "holdings", "international", "american", "united"}
+
+class FanOutRetriever(BaseRetriever):
+    """
+    Retriever searching several companies concurrently, one retriever per company (its own index or cik filter)
+    Companies named in the question are searched, all companies if none is named. Results are merged round-robin
+    with a quota of k // companies documents per company, so every company is in the context of a comparative question
+    and latency is that of the slowest company, not the sum.
+    """
+    retrievers: Dict[str, Any]
+    k: int = 8
+    timeout: float = 30
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def get_companies(self, query: str) -> list:
+        """
+        Companies named in the question by ticker or name, all companies if none is named
+            'Compare AAPL and MSFT risk factors' -> ['Apple Inc. (AAPL)', 'MICROSOFT CORP (MSFT)']
+        """
+        words = set(re.findall(r"\w+", query.lower()))
+        named = []
+        for company in self.retrievers:
+            ticker = company.rsplit("(", 1)[-1].strip(") ") if company.endswith(")") else ""
+            name_words = [word for word in re.findall(r"\w+", company.rsplit("(", 1)[0].lower()) if word not in GENERIC_NAME_WORDS]
+            # Tickers are matched as written (upper case), short ones ('A', 'ON') are common words otherwise
+            if (ticker and re.search(rf"\b{re.escape(ticker)}\b", query)) or (name_words and name_words[0] in words):
+                named.append(company)
+        return named or list(self.retrievers)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        companies = self.get_companies(query)
+        quota = max(1, self.k // len(companies))
+        with tracer.span("retrieve.fanout", companies=len(companies)) as span:
+            executor = ThreadPoolExecutor(max_workers=len(companies))
+            futures = {company: executor.submit(self.retrievers[company].invoke, query, {"callbacks": run_manager.get_child()}) for company in companies}
+            results = {}
+            for company, future in futures.items():
+                try:
+                    results[company] = future.result(timeout=self.timeout)
+                except Exception as e:
+                    tracer.count("retrieve.fanout_errors")
+                    print(f"Retrieval for {company} failed: {e}")
+            executor.shutdown(wait=False)
+
+            # Round-robin by rank within each company's quota
+            ranked = [[Document(page_content=document.page_content, metadata={**document.metadata, "company": company}) for document in documents[:quota]]
+                      for company, documents in results.items()]
+            merged = [documents[rank] for rank in range(quota) for documents in ranked if rank < len(documents)]
+            span["documents"] = len(merged)
+        return merged
@@ -1,11 +1,15 @@
 import requests
+from tracing import tracer
+from edgar_client import EdgarClient
 
 class FetchFilings:
-    def __init__(self, headers:dict):
+    def __init__(self, headers:dict, client: EdgarClient=None):
         """
         headers (dict): headers for request to api
+        client (EdgarClient): shared EDGAR http client (pooled, rate limited, cached), created from headers if not provided
         """
         self.headers = headers
+        self.client = client or EdgarClient(headers)
 
     def get_companies_cik(self) -> dict:
         """
@@ -16,11 +20,11 @@ class FetchFilings:
             (dict): dictionary of {name (ticker): cik} 
                 'Apple Inc. (AAPL)': '0000320193'
         """
-        headers = self.headers
         company_tickers_url = "https://www.sec.gov/files/company_tickers.json"
-        company_tickers = requests.get(url = company_tickers_url, headers=headers)
-        company_tickers = company_tickers.json()
-        company_tickers = {f"{val['title']} ({val['ticker']})": str(val['cik_str']).zfill(10) for val in company_tickers.values()}
+        with tracer.span("edgar.get_companies_cik") as span:
+            company_tickers = self.client.get_json(url=company_tickers_url, cache=True)
+            company_tickers = {f"{val['title']} ({val['ticker']})": str(val['cik_str']).zfill(10) for val in company_tickers.values()}
+            span["companies"] = len(company_tickers)
 
         return company_tickers
 
@@ -53,37 +57,52 @@ class FetchFilings:
         """
         Get SEC filings for a company by CIK (Central Index Key) from EDGAR for last 2 filings
         API Reference: https://sec-api.io/docs/sec-filings-item-extraction-api
+        Older filings are read from the submissions history files when 'recent' has fewer than count 10-K filings.
         Args:
             cik (str): Central Index Key (CIK) of the company.
             
             count (int): N most recent 10-K filings for the company
         Returns:
-            list[dict]: List of recent filings' url and date
+            list[dict]: List of recent filings' url, date, cik and accession number
         """
         # API URL
         base_url = f"https://data.sec.gov/submissions/CIK{cik}.json"
-        headers = self.headers
-        response = requests.get(url=base_url, headers=headers)
         form_filter = '10-K'
 
         # Check and return successful response
-        if response.status_code == 200:
-            data = response.json()
-            
-            # URL for 10K files
-            filings = data['filings']['recent']
-            form_filings = [
-                {
-                    "url": f"https://www.sec.gov/Archives/edgar/data/{int(cik)}/{accesion_no.replace('-','')}/{primary_document}",
-                    "date": filing_date,
-                }
-                for form, accesion_no, primary_document, filing_date in zip(filings['form'], filings['accessionNumber'], filings['primaryDocument'], filings['filingDate'],)
-                if form == form_filter
-            ]
+        try:
+            with tracer.span("edgar.get_recent_filings_10K", cik=cik) as span:
+                data = self.client.get_json(url=base_url, cache=True)
+                
+                # URL for 10K files
+                form_filings = self._get_form_filings(cik, data['filings']['recent'], form_filter)
+
+                # Older filings are paged into history files (newest first)
+                for history_file in data['filings'].get('files', []):
+                    if len(form_filings) >= count:
+                        break
+                    filings = self.client.get_json(url=f"https://data.sec.gov/submissions/{history_file['name']}", cache=True)
+                    form_filings.extend(self._get_form_filings(cik, filings, form_filter))
+                span["filings"] = len(form_filings[:count])
             
             # Return filings
             return form_filings[:count]
         
-        else:
-            print("Error fetching data:", response.status_code)
+        except requests.RequestException as e:
+            print("Error fetching data:", e)
             return []
+
+    def _get_form_filings(self, cik: str, filings: dict, form_filter: str) -> list:
+        """
+        Get url and date of filings of a form type from columnar submissions data
+        """
+        return [
+            {
+                "url": f"https://www.sec.gov/Archives/edgar/data/{int(cik)}/{accesion_no.replace('-','')}/{primary_document}",
+                "date": filing_date,
+                "cik": cik,
+                "accession": accesion_no,
+            }
+            for form, accesion_no, primary_document, filing_date in zip(filings['form'], filings['accessionNumber'], filings['primaryDocument'], filings['filingDate'],)
+            if form == form_filter
+        ]
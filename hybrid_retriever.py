@@ -0,0 +1,182 @@
+import re
+import math
+from typing import Any, Dict, List, Optional
+from collections import Counter
+from qdrant_client.http import models
+from langchain_qdrant import QdrantVectorStore
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+
+# Section names that are common words in questions ('business segments', 'other information'), they boost the
+# ranking of the section's chunks instead of filtering on it
+GENERIC_SECTION_NAMES = {'other information'}
+STOPWORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in', 'is', 'it', 'of', 'on', 'or',
+             'that', 'the', 'their', 'this', 'to', 'was', 'were', 'what', 'when', 'which', 'who', 'with', 'does', 'did', 'do'}
+
+def extract_years(text: str) -> list:
+    """
+    Years mentioned in a text ('What were the 2023 risk factors?' -> [2023])
+    """
+    return sorted({int(year) for year in re.findall(r"\b((?:19|20)\d{2})\b", text)})
+
+def tokenize(text: str) -> list:
+    """
+    Lowercase word tokens without stopwords
+    """
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, documents: list, k1: float=1.5, b: float=0.75):
+        """
+        In-memory BM25 index over documents
+        Args:
+            documents (list[Document]): documents to index
+            k1, b: BM25 term frequency saturation and length normalization
+        """
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = []
+        for doc_no, document in enumerate(documents):
+            tokens = tokenize(document.page_content)
+            self.lengths.append(len(tokens))
+            for token, frequency in Counter(tokens).items():
+                self.postings.setdefault(token, []).append((doc_no, frequency))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+
+    def search(self, query: str, k: int=20, allowed=None) -> list:
+        """
+        Top k documents for query
+        Args:
+            query (str): search text
+            k (int): number of documents
+            allowed (callable): optional metadata filter, allowed(metadata) -> bool
+        Returns:
+            list[Document]: documents ordered by BM25 score
+        """
+        scores = {}
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token, [])
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_no, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_no] / self.avg_length)
+                scores[doc_no] = scores.get(doc_no, 0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        if allowed:
+            ranked = [doc_no for doc_no in ranked if allowed(self.documents[doc_no].metadata)]
+        return [self.documents[doc_no] for doc_no in ranked[:k]]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining BM25 (sparse) and Qdrant (dense) search with reciprocal rank fusion
+    Years and 10-K sections mentioned in the question are pushed down as Qdrant payload filters,
+    sections named by a common word ('Business', 'Properties') only boost the ranking of their chunks.
+    """
+    vectorstore: QdrantVectorStore
+    bm25: BM25Index
+    search_filter: Optional[models.Filter] = None
+    search_params: Optional[models.SearchParams] = None
+    sections: Dict[str, str] = {}
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    section_boost: float = 1.5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: QdrantVectorStore, search_filter: models.Filter=None, sections: dict=None, **kwargs: Any) -> "HybridRetriever":
+        """
+        Build BM25 index from the chunks in the collection (only the session's chunks when search_filter is set)
+        Args:
+            vectorstore: Qdrant vector store
+            search_filter: Qdrant filter for the session's data
+            sections (dict): 10-K sections {item: name} to detect in questions
+        """
+        documents = []
+        offset = None
+        while True:
+            points, offset = vectorstore.client.scroll(collection_name=vectorstore.collection_name, scroll_filter=search_filter,
+                                                       limit=512, offset=offset, with_payload=True, with_vectors=False)
+            for point in points:
+                metadata = dict(point.payload.get(vectorstore.metadata_payload_key) or {})
+                metadata["_id"] = point.id
+                documents.append(Document(page_content=point.payload.get(vectorstore.content_payload_key, ""), metadata=metadata))
+            if offset is None:
+                break
+        return cls(vectorstore=vectorstore, bm25=BM25Index(documents), search_filter=search_filter, sections=sections or {}, **kwargs)
+
+    def extract_filters(self, query: str) -> dict:
+        """
+        Get years and sections mentioned in the question
+        A 10-K for fiscal year Y is usually filed in Y or Y+1, so both filing years are searched
+        Sections are filtered on when referenced by Item number or by a full multi-word name
+            'What were the 2023 risk factors?' -> {'year': [2023, 2024], 'section': ['Risk Factors']}
+            'How did business segments revenue change?' -> {} ('Business' is boosted, see get_boosted_sections)
+        """
+        filters = {}
+        years = sorted({year + offset for year in extract_years(query) for offset in (0, 1)})
+        if years:
+            filters["year"] = years
+        query_lower = query.lower()
+        items = {item.lower() for item in re.findall(r"\bitem\s*(\d{1,2}[a-c]?)\b", query_lower)}
+        sections = [name for item, name in self.sections.items()
+                    if item.lower() in items or (not self._is_generic_section(name) and self._names_section(query_lower, name))]
+        if sections:
+            filters["section"] = sections
+        return filters
+
+    def get_boosted_sections(self, query: str, filters: dict) -> set:
+        """
+        Sections named in the question by a common word, not filtered on
+            'What cybersecurity incidents were reported?' -> {'Cybersecurity'}
+        """
+        query_lower = query.lower()
+        return {name for name in self.sections.values()
+                if self._is_generic_section(name) and self._names_section(query_lower, name) and name not in filters.get("section", [])}
+
+    def _is_generic_section(self, name: str) -> bool:
+        return len(name.split()) == 1 or name.lower() in GENERIC_SECTION_NAMES
+
+    def _names_section(self, query_lower: str, name: str) -> bool:
+        return re.search(rf"\b{re.escape(name.lower())}\b", query_lower) is not None
+
+    def _get_qdrant_filter(self, filters: dict) -> models.Filter:
+        """
+        Qdrant filter of the session filter and filters extracted from the question
+        """
+        must = [self.search_filter] if self.search_filter else []
+        for key, values in filters.items():
+            must.append(models.FieldCondition(key=f"metadata.{key}", match=models.MatchAny(any=values)))
+        return models.Filter(must=must) if must else None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        filters = self.extract_filters(query)
+        boosted = self.get_boosted_sections(query, filters)
+        allowed = (lambda metadata: all(metadata.get(key) in values for key, values in filters.items())) if filters else None
+
+        dense = self.vectorstore.similarity_search(query, k=self.fetch_k, filter=self._get_qdrant_filter(filters), search_params=self.search_params)
+        sparse = self.bm25.search(query, k=self.fetch_k, allowed=allowed)
+        # Nothing matches the extracted filters, search everything of the session
+        if filters and not dense and not sparse:
+            dense = self.vectorstore.similarity_search(query, k=self.fetch_k, filter=self.search_filter, search_params=self.search_params)
+            sparse = self.bm25.search(query, k=self.fetch_k)
+
+        # Reciprocal rank fusion
+        scores, documents = {}, {}
+        for ranking in (dense, sparse):
+            for rank, document in enumerate(ranking):
+                key = str(document.metadata.get("_id", document.page_content))
+                scores[key] = scores.get(key, 0) + 1 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, document)
+        for key, document in documents.items():
+            if document.metadata.get("section") in boosted:
+                scores[key] *= self.section_boost
+        return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:self.k]]
@@ -0,0 +1,92 @@
+import os
+import time
+import sqlite3
+import threading
+
+class IngestionManifest:
+    # States of a (filing, section) unit
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path: str=".cache/ingestion_manifest.sqlite"):
+        """
+        Record of the (filing, section) units ingested into each Qdrant collection
+        Every unit has a state ('done' or 'failed'), the sha256 of its section text, its number of chunks,
+        the number of failed attempts and the last error, so re-ingestion only fetches the delta:
+        new filings, newly selected sections and units that failed before.
+        Args:
+            path (str): sqlite file of the manifest
+        """
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS units (collection TEXT, accession TEXT, section TEXT, url TEXT, state TEXT,
+                                   content_hash TEXT, chunks INTEGER, attempts INTEGER, error TEXT, updated REAL,
+                                   PRIMARY KEY (collection, accession, section))""")
+        self.connection.commit()
+
+    def get_units(self, collection: str, accessions: list=None) -> dict:
+        """
+        Units of a collection
+        Args:
+            collection (str): Qdrant collection name
+            accessions (list): only units of these filings
+        Returns:
+            dict: {(accession, section): {"url", "state", "content_hash", "chunks", "attempts", "error", "updated"}}
+        """
+        query = "SELECT accession, section, url, state, content_hash, chunks, attempts, error, updated FROM units WHERE collection = ?"
+        params = [collection]
+        if accessions is not None:
+            query += f" AND accession IN ({','.join('?' * len(accessions))})"
+            params.extend(accessions)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return {(accession, section): {"url": url, "state": state, "content_hash": content_hash, "chunks": chunks, "attempts": attempts, "error": error, "updated": updated}
+                for accession, section, url, state, content_hash, chunks, attempts, error, updated in rows}
+
+    def mark_done(self, collection: str, units: list):
+        """
+        Record units as ingested
+        Args:
+            units (list[dict]): [{"accession", "section", "url", "content_hash", "chunks"}]
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("""INSERT INTO units VALUES (?, ?, ?, ?, ?, ?, ?, 0, NULL, ?)
+                                           ON CONFLICT (collection, accession, section) DO UPDATE SET url = excluded.url, state = excluded.state,
+                                           content_hash = COALESCE(excluded.content_hash, content_hash), chunks = COALESCE(excluded.chunks, chunks),
+                                           attempts = 0, error = NULL, updated = excluded.updated""",
+                                        [(collection, unit["accession"], unit["section"], unit["url"], self.DONE, unit.get("content_hash"), unit.get("chunks"), now) for unit in units])
+            self.connection.commit()
+
+    def mark_failed(self, collection: str, units: list):
+        """
+        Record failed units, attempts are counted across runs
+        Args:
+            units (list[dict]): [{"accession", "section", "url", "error"}]
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("""INSERT INTO units VALUES (?, ?, ?, ?, ?, NULL, NULL, 1, ?, ?)
+                                           ON CONFLICT (collection, accession, section) DO UPDATE SET url = excluded.url, state = excluded.state,
+                                           attempts = attempts + 1, error = excluded.error, updated = excluded.updated""",
+                                        [(collection, unit["accession"], unit["section"], unit["url"], self.FAILED, unit["error"], now) for unit in units])
+            self.connection.commit()
+
+    def forget(self, collection: str):
+        """
+        Drop all units of a collection (collection deleted)
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM units WHERE collection = ?", (collection,))
+            self.connection.commit()
+
+    def stats(self, collection: str) -> dict:
+        """
+        Number of units per state of a collection
+        Returns:
+            dict: {"done": int, "failed": int}
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM units WHERE collection = ? GROUP BY state", (collection,)).fetchall()
+        return {self.DONE: 0, self.FAILED: 0, **dict(rows)}
@@ -1,10 +1,27 @@
 
-from langchain_groq import ChatGroq
-from langchain_openai import OpenAI
+import re
+from operator import itemgetter
 from langchain.chains import create_retrieval_chain
 from langchain.chains import create_history_aware_retriever
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableGenerator, RunnableLambda, RunnableParallel, RunnablePassthrough
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from hybrid_retriever import HybridRetriever
+from fanout_retriever import FanOutRetriever
+from answer_cache import SemanticAnswerCache
+from context_packer import ContextPacker
+from xbrl_facts import XbrlFacts
+from tracing import tracer
+
+# Words referring back to earlier turns of the chat ('it', 'their', 'the previous year', 'what about ...')
+BACK_REFERENCES = re.compile(r"\b(it|its|they|them|their|theirs|this|that|these|those|he|she|him|her|his|same|above|previous|previously|"
+                             r"earlier|former|latter|mentioned|again|else|another|too|instead)\b|^(and|but|or|so|also|what about|how about|why)\b",
+                             re.IGNORECASE)
+
+# Token budget of the retrieved context for each provider's model (prompt, chat history and answer share the context window)
+CONTEXT_TOKENS = {"openai": 1200, # gpt-3.5-turbo-instruct: 4096 tokens
+                  "groq": 1500,} # Gemma2-9b-It: 8192 tokens
 
 class LlmRag:
 
@@ -17,15 +34,26 @@ class LlmRag:
         Returns:
             llm
         """
+        # Imported here so only the selected provider's client library is loaded
         if provider.lower() == 'openai':
+            from langchain_openai import OpenAI
             model_name = "gpt-3.5-turbo-instruct"
             llm = OpenAI(model=model_name, api_key=api_key, temperature=0, max_tokens=500, max_retries=2)
         elif provider.lower() == 'groq':
+            from langchain_groq import ChatGroq
             model_name = "Gemma2-9b-It"
             llm=ChatGroq(groq_api_key=api_key,model_name=model_name)
         return llm
 
-    def get_rag_chain(self, vectorstore, llm):
+    def get_context_budget(self, provider: str) -> int:
+        """
+        Token budget of the retrieved context for the provider's model
+        """
+        return CONTEXT_TOKENS.get(provider.lower(), 1200)
+
+    def get_rag_chain(self, vectorstore, llm, search_filter=None, hybrid: bool=False, sections: dict=None, answer_cache: SemanticAnswerCache=None,
+                      fast_rewrite: bool=False, context_tokens: int=None, context_k: int=8,
+                      search_params=None, xbrl_facts: XbrlFacts=None, ciks: list=None, company_filters: dict=None, selected_sections: dict=None):
         """
         Get RAG chain from the vectorstore, llm and chat history
         The contextually related question is converted to standalone question using llm and history aware retriever
@@ -33,9 +61,37 @@ class LlmRag:
         Args:
             vectorstore: Qdrant vector store
             llm: groq, openai
+            search_filter: Qdrant filter to search only the session's data in a shared collection
+            hybrid: use BM25 + dense retrieval with year/section filters from the question (HybridRetriever)
+            sections: 10-K sections {item: name} detected in questions (hybrid)
+            answer_cache: serve answers of similar standalone questions over the same collection and filter from the cache
+            fast_rewrite: skip the standalone question LLM call for questions without back references to the chat history,
+                otherwise retrieve for the question in parallel with the rewrite
+            context_tokens: retrieve context_k chunks and pack them to this token budget (ContextPacker), all 4 retrieved chunks if None
+            context_k: number of chunks retrieved for packing (context_tokens)
+            search_params: Qdrant search params, e.g. rescoring of quantized collections (QdrantVectorsManager.get_search_params)
+            xbrl_facts: answer numeric questions about the companies ciks from their XBRL financial data without retrieval and generation
+            ciks: CIKs of the session's companies (xbrl_facts)
+            company_filters: multi-company mode, {company: Qdrant filter of its data} searched concurrently (FanOutRetriever)
+                with k // companies chunks per company, search_filter is not used
+            selected_sections: 10-K sections {item: name} of the session's data, part of the answer_cache scope
         """
         # Create retriever from vectorstore
-        retriever = vectorstore.as_retriever() #search_kwargs={"k": 5}
+        k = context_k if context_tokens else 4
+        def get_retriever(search_filter):
+            if hybrid:
+                return HybridRetriever.from_vectorstore(vectorstore, search_filter=search_filter, sections=sections, k=k, search_params=search_params)
+            search_kwargs = {"filter": search_filter, "k": k} if search_filter else {"k": k}
+            if search_params:
+                search_kwargs["search_params"] = search_params
+            return vectorstore.as_retriever(search_kwargs=search_kwargs) #search_kwargs={"k": 5}
+        if company_filters:
+            retriever = FanOutRetriever(retrievers={company: get_retriever(company_filter) for company, company_filter in company_filters.items()}, k=k)
+        else:
+            retriever = get_retriever(search_filter)
+        if context_tokens:
+            # Adjacent chunks merged, near duplicates dropped, packed to the model's budget
+            retriever = retriever | RunnableLambda(ContextPacker(max_tokens=context_tokens).pack)
         
         # Contextualizing the question (Standalone question generation)
         contextualize_q_system_prompt = (
@@ -66,9 +122,141 @@ class LlmRag:
                 ]
             )  
         
-        history_aware_retriever=create_history_aware_retriever(llm,retriever,contextualize_q_prompt)
-        question_answer_chain=create_stuff_documents_chain(llm,qa_prompt)
-        rag_chain=create_retrieval_chain(history_aware_retriever,question_answer_chain)
+        # Chunks are labeled with their company when comparing companies
+        document_prompt = PromptTemplate.from_template("[{company}]\n{page_content}") if company_filters else None
+        question_answer_chain=create_stuff_documents_chain(llm,qa_prompt,document_prompt=document_prompt)
+        if fast_rewrite or answer_cache is not None:
+            scope = answer_cache.get_scope(vectorstore.collection_name, company_filters or search_filter, selected_sections) if answer_cache is not None else None
+            rag_chain = self._get_planned_rag_chain(retriever, llm, contextualize_q_prompt, question_answer_chain, fast_rewrite=fast_rewrite,
+                                                    answer_cache=answer_cache, scope=scope)
+        else:
+            history_aware_retriever=create_history_aware_retriever(llm,retriever,contextualize_q_prompt)
+            rag_chain=create_retrieval_chain(history_aware_retriever,question_answer_chain)
 
+        if xbrl_facts is not None and ciks:
+            rag_chain = self._get_facts_routed_chain(rag_chain, xbrl_facts, ciks, fast_rewrite=fast_rewrite)
         return rag_chain
-        
+
+    def is_standalone_question(self, question: str) -> bool:
+        """
+        Whether a question can be understood without the chat history (no pronouns or references to earlier turns)
+            'What are the risk factors of Apple in 2023?' -> True, 'How did it change from the previous year?' -> False
+        """
+        return len(question.split()) >= 4 and not BACK_REFERENCES.search(question.strip())
+
+    def _get_planned_rag_chain(self, retriever, llm, contextualize_q_prompt, question_answer_chain, fast_rewrite: bool=False,
+                               answer_cache: SemanticAnswerCache=None, scope: tuple=None):
+        """
+        RAG chain with explicit query planning and optional answer cache
+        Standalone question: the input as is without chat history (same as create_history_aware_retriever),
+        with fast_rewrite also when the input has no back references, otherwise retrieval on the input runs
+        in parallel with the rewrite and its documents are used if the rewrite returns the input unchanged.
+        Answer cache: on a hit the cached answer and sources are returned without retrieval and generation,
+        on a miss the answer is streamed as usual and saved to the cache when the stream completes.
+        Output has the same "context" and "answer" keys as the chain from create_retrieval_chain and
+        "query_plan": {"plan": 'no_history'|'standalone'|'rewrite_unchanged'|'rewritten', "llm_calls_saved": int, "cached": bool}
+        """
+        rewrite_chain = (contextualize_q_prompt | llm | StrOutputParser()).with_config(run_name="chat_retriever_chain")
+
+        def get_plan(name: str, question: str, llm_calls_saved: int=0, context: list=None) -> dict:
+            if llm_calls_saved:
+                tracer.count("llm.calls_saved", llm_calls_saved)
+            plan = {"standalone_question": question, "query_plan": {"plan": name, "llm_calls_saved": llm_calls_saved, "cached": False}}
+            if context is not None:
+                tracer.count("retrieve.prefetch_used")
+                plan["context"] = context
+            return plan
+
+        def get_rewrite_plan(x: dict) -> dict:
+            if " ".join(re.findall(r"\w+", x["rewritten"].lower())) == " ".join(re.findall(r"\w+", x["input"].lower())):
+                return get_plan("rewrite_unchanged", x["input"], context=x["prefetched"])
+            return get_plan("rewritten", x["rewritten"])
+
+        if fast_rewrite:
+            # Retrieval on the input does not wait for the rewrite
+            rewrite_plan_chain = RunnableParallel(input=itemgetter("input"), rewritten=rewrite_chain, prefetched=itemgetter("input") | retriever) | get_rewrite_plan
+        else:
+            rewrite_plan_chain = rewrite_chain | (lambda question: get_plan("rewritten", question))
+        plan_chain = RunnableBranch(
+            (lambda x: not x.get("chat_history"), lambda x: get_plan("no_history", x["input"])),
+            (lambda x: fast_rewrite and self.is_standalone_question(x["input"]), lambda x: get_plan("standalone", x["input"], llm_calls_saved=1)),
+            rewrite_plan_chain,
+        )
+
+        retrieval_chain = (
+            RunnablePassthrough.assign(context=RunnableBranch(
+                (lambda x: x.get("context") is not None, itemgetter("context")),
+                itemgetter("standalone_question") | retriever,
+            )).with_config(run_name="retrieve_documents")
+            .assign(answer=question_answer_chain)
+        )
+        rag_chain = RunnablePassthrough.assign(plan=plan_chain) | (lambda x: {**{key: value for key, value in x.items() if key != "plan"}, **x["plan"]})
+        if answer_cache is None:
+            return (rag_chain | retrieval_chain).with_config(run_name="retrieval_chain")
+
+        def get_cached_answer(x: dict) -> dict:
+            # Retrieval and generation are skipped
+            tracer.count("llm.calls_saved")
+            return {**x["cached"], "query_plan": {**x["query_plan"], "llm_calls_saved": x["query_plan"]["llm_calls_saved"] + 1, "cached": True}}
+
+        def save_answer(chunks):
+            # Pass the streamed chunks through and cache the complete answer
+            output = {"answer": ""}
+            for chunk in chunks:
+                for key, value in chunk.items():
+                    if key == "answer":
+                        output["answer"] += value
+                    else:
+                        output[key] = value
+                yield chunk
+            answer_cache.set(output["standalone_question"], scope, output["answer"], output.get("context"))
+
+        return (
+            rag_chain
+            | RunnablePassthrough.assign(cached=lambda x: answer_cache.get(x["standalone_question"], scope))
+            | RunnableBranch(
+                (lambda x: x["cached"] is not None, get_cached_answer),
+                retrieval_chain | RunnableGenerator(save_answer),
+            )
+        ).with_config(run_name="retrieval_chain")
+
+    def _get_facts_routed_chain(self, rag_chain, xbrl_facts: XbrlFacts, ciks: list, fast_rewrite: bool=False):
+        """
+        Route questions asking for reported figures ('What was revenue growth 2021-2023?') to the XBRL facts store
+        The exact figures are the answer, other questions go to rag_chain. Output has the "context", "answer"
+        and "query_plan" keys of the planned chain, with plan 'xbrl_facts'.
+        """
+        def get_facts_answer(x: dict) -> dict:
+            # Generation is skipped, and so is the standalone question rewrite rag_chain would have made
+            llm_calls_saved = 1 + int(bool(x.get("chat_history")) and not (fast_rewrite and self.is_standalone_question(x["input"])))
+            tracer.count("llm.calls_saved", llm_calls_saved)
+            return {**x["facts"], "query_plan": {"plan": "xbrl_facts", "llm_calls_saved": llm_calls_saved, "cached": False}}
+
+        return (
+            RunnablePassthrough.assign(facts=lambda x: xbrl_facts.answer(x["input"], ciks))
+            | RunnableBranch(
+                (lambda x: x["facts"] is not None, get_facts_answer),
+                (lambda x: {key: value for key, value in x.items() if key != "facts"}) | rag_chain,
+            )
+        ).with_config(run_name="facts_router")
+
+    def stream_answer(self, conversational_rag_chain, query: str, config: dict):
+        """
+        Stream answer of the conversational RAG chain (OpenAI and Groq)
+        Retrieved documents are yielded as soon as retrieval finishes, then answer tokens as they are generated.
+        Chat history is saved by RunnableWithMessageHistory once the stream completes.
+        Args:
+            conversational_rag_chain: RunnableWithMessageHistory over the chain from get_rag_chain
+            query (str): user question
+            config (dict): runnable config with session_id
+        Yields:
+            tuple: ("context", list[Document]) once, then ("answer", str) for each token,
+                ("plan", dict) with the query plan of chains with fast_rewrite, answer_cache or xbrl_facts
+        """
+        for chunk in conversational_rag_chain.stream({"input": query}, config=config):
+            if "query_plan" in chunk:
+                yield "plan", chunk["query_plan"]
+            if "context" in chunk:
+                yield "context", chunk["context"]
+            if "answer" in chunk:
+                yield "answer", chunk["answer"]
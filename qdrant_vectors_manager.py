@@ -1,74 +1,383 @@
-from uuid import uuid4
+import re
+import time
+import hashlib
+from uuid import uuid5, NAMESPACE_URL
+from tracing import tracer
+from ratelimiter import RateLimiter
+from ingestion_manifest import IngestionManifest
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from sec_api import ExtractorApi
 from qdrant_client import QdrantClient
 from langchain_openai import OpenAIEmbeddings
 from langchain_qdrant import QdrantVectorStore
+from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from chunker import SectionChunker
+
+EXTRACTOR_API_HOST = "api.sec-api.io"
+PAYLOAD_INDEXES = {"metadata.cik": models.PayloadSchemaType.KEYWORD,
+                   "metadata.accession": models.PayloadSchemaType.KEYWORD,
+                   "metadata.section": models.PayloadSchemaType.KEYWORD,
+                   "metadata.details": models.PayloadSchemaType.KEYWORD,
+                   "metadata.year": models.PayloadSchemaType.INTEGER,}
+INT8_QUANTIZATION = models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+# Collection storage settings, quantized profiles keep compact vectors in RAM and rescore the top candidates (x oversampling)
+# with the original vectors from disk
+STORAGE_PROFILES = {"default": {}, # float32 vectors, payloads and HNSW graph in RAM
+                    "int8": {"on_disk": True, "quantization": INT8_QUANTIZATION, "oversampling": 1.5}, # 4x smaller vectors in RAM
+                    "binary": {"on_disk": True, "quantization": models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True)),
+                               "oversampling": 3.0}, # 32x smaller vectors in RAM, needs >= 1024 dimensions for good recall
+                    "compact": {"on_disk": True, "on_disk_payload": True, "quantization": INT8_QUANTIZATION, "oversampling": 2.0,
+                                "hnsw": models.HnswConfigDiff(m=8, ef_construct=64)},} # int8, payloads on disk, smaller HNSW graph
 
 class QdrantVectorsManager:
 
-    def initialize_vectorstore(self, collection_name: str, qdrant_client: QdrantClient, embeddings: OpenAIEmbeddings) -> QdrantVectorStore:
+    def initialize_vectorstore(self, collection_name: str, qdrant_client: QdrantClient, embeddings: OpenAIEmbeddings, vector_params: VectorParams=None,
+                               storage_profile: str="default") -> QdrantVectorStore:
         """
         Initialize Qdrant Vectorstore
         Create collection with collection name
-            Config: Vectorsize = 1536 
+            Config: Vectorsize = 1536 (or size of the embedding backend in vector_params)
             Config: distance = Cosine
+            Config: storage_profile ('default', 'int8', 'binary', 'compact' in STORAGE_PROFILES)
+            Payload indexes: metadata.cik, metadata.accession, metadata.section, metadata.details (keyword), metadata.year (integer)
         """
-        qdrant_client.create_collection(collection_name=collection_name, vectors_config=VectorParams(size=1536, distance=Distance.COSINE),)
+        self.create_collection(collection_name, qdrant_client, vector_params, storage_profile)
         return QdrantVectorStore(client=qdrant_client, collection_name=collection_name, embedding=embeddings,)
 
-    def save_to_vectorstore(self, data: list, vector_store: QdrantVectorStore, type_of_data: str='filings', sections:dict=None, extractorApi: ExtractorApi=None):
+    def initialize_shared_vectorstore(self, collection_name: str, qdrant_client: QdrantClient, embeddings: OpenAIEmbeddings, vector_params: VectorParams=None,
+                                      storage_profile: str="default") -> QdrantVectorStore:
+        """
+        Initialize Qdrant Vectorstore shared by all sessions (shared corpus)
+        Create collection only if it does not exist, with payload indexes for filtering sessions' data
+            Config: Vectorsize = 1536 (or size of the embedding backend in vector_params)
+            Config: distance = Cosine
+            Config: storage_profile ('default', 'int8', 'binary', 'compact' in STORAGE_PROFILES), used only when the collection is created
+            Payload indexes: metadata.cik, metadata.accession, metadata.section, metadata.details (keyword), metadata.year (integer)
+        """
+        if not qdrant_client.collection_exists(collection_name=collection_name):
+            self.create_collection(collection_name, qdrant_client, vector_params, storage_profile)
+        return QdrantVectorStore(client=qdrant_client, collection_name=collection_name, embedding=embeddings,)
+
+    def create_collection(self, collection_name: str, qdrant_client: QdrantClient, vector_params: VectorParams=None, storage_profile: str="default"):
+        """
+        Create collection with the vector size/distance of vector_params, the storage profile settings and payload indexes
+        """
+        vector_params = vector_params or VectorParams(size=1536, distance=Distance.COSINE)
+        profile = STORAGE_PROFILES[storage_profile]
+        qdrant_client.create_collection(collection_name=collection_name,
+                                        vectors_config=VectorParams(size=vector_params.size, distance=vector_params.distance, on_disk=profile.get("on_disk")),
+                                        quantization_config=profile.get("quantization"),
+                                        hnsw_config=profile.get("hnsw"),
+                                        on_disk_payload=profile.get("on_disk_payload"),)
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            qdrant_client.create_payload_index(collection_name=collection_name, field_name=field_name, field_schema=field_schema)
+
+    def get_search_params(self, storage_profile: str="default") -> models.SearchParams:
+        """
+        Search params of a storage profile: quantized search rescored with the original vectors, None for full precision
+        """
+        profile = STORAGE_PROFILES[storage_profile]
+        if not profile.get("quantization"):
+            return None
+        return models.SearchParams(quantization=models.QuantizationSearchParams(rescore=True, oversampling=profile["oversampling"]))
+
+    def get_point_id(self, *keys) -> str:
+        """
+        Deterministic point id from keys, same data always maps to the same point
+            get_point_id('0000320193-23-000106', '1A', 0) -> uuid5 of '0000320193-23-000106/1A/0'
+        """
+        return str(uuid5(NAMESPACE_URL, "/".join(str(key) for key in keys)))
+
+    def get_shared_collection_name(self, collection_name: str, embedding_namespace: str) -> str:
+        """
+        Name of the shared collection for an embedding model, vectors of different models cannot share a collection
+            ('sec_filings_10k', 'openai:text-embedding-3-small') -> 'sec_filings_10k__openai_text-embedding-3-small'
+        """
+        return f"{collection_name}__{re.sub(r'[^A-Za-z0-9_-]', '_', embedding_namespace)}"
+
+    def get_filter(self, filings: list, cik=None, sections: dict=None) -> models.Filter:
+        """
+        Qdrant filter selecting a session's data from the shared corpus
+        Args:
+            filings (list[dict]): selected filings (from FetchFilings.get_recent_filings_10K)
+            cik (str | list): selected company cik(s), includes their web data (stock info, news)
+            sections (dict): selected 10-K sections {item: name}, sections other sessions ingested for the filings are left out
+        Returns:
+            models.Filter: filter on metadata.accession and metadata.section, or metadata.cik (web data)
+        """
+        filing_conditions = [models.FieldCondition(key="metadata.accession", match=models.MatchAny(any=[filing['accession'] for filing in filings]))]
+        if sections:
+            filing_conditions.append(models.FieldCondition(key="metadata.section", match=models.MatchAny(any=list(sections.values()))))
+        conditions = [models.Filter(must=filing_conditions)]
+        if cik:
+            conditions.append(models.Filter(must=[
+                models.FieldCondition(key="metadata.cik", match=models.MatchAny(any=cik) if isinstance(cik, list) else models.MatchValue(value=cik)),
+                models.FieldCondition(key="metadata.details", match=models.MatchAny(any=["stock", "news"])),
+            ]))
+        return models.Filter(should=conditions)
+
+    def get_company_filter(self, cik: str) -> models.Filter:
+        """
+        Qdrant filter selecting one company's data (filings and web data) of a collection
+        """
+        return models.Filter(must=[models.FieldCondition(key="metadata.cik", match=models.MatchValue(value=cik))])
+
+    def save_to_vectorstore(self, data: list, vector_store: QdrantVectorStore, type_of_data: str='filings', sections:dict=None, extractorApi: ExtractorApi=None,
+                            max_workers: int=8, batch_size: int=256, rate_limiter: RateLimiter=None, cik: str=None, stats: dict=None,
+                            manifest: IngestionManifest=None, max_retries: int=2, retry_backoff: float=1.0, chunker: SectionChunker=None):
         """
         Saves data (list of text) into Qdrant vectorstore with metadata
-        ExtractorApi fetches data for each section. 
+        ExtractorApi fetches data for each (filing, section) concurrently on a bounded worker pool,
+        sections are chunked as they arrive (SectionChunker: token sized, tables kept whole) and chunks are streamed into
+        fixed size batches upserted while the remaining sections are fetched.
+        Point ids are derived from (accession, section, chunk), so sections already in the collection are skipped.
+        With a manifest only the delta is fetched: sections recorded as done are skipped without asking Qdrant,
+        sections that failed in an earlier run are fetched again and every outcome is recorded.
         Args:
-            data (list[str]): Data to be stored in vectorstore
+            data (list[str]): Data to be stored in vectorstore ({source: text} from Scraper.get_web_data for type_of_data=='web')
             vector_store: Qdrant vector store
-            type_of_data: ['filings', 'stock_info', 'news']
+            type_of_data: ['filings', 'stock_info', 'news', 'web']
             sections: 10-k filing sections dictionary (type_of_data=='filings)
             extractorApi: EDGAR API to get filings data (type_of_data=='filings)
+            max_workers: number of sections fetched in parallel (type_of_data=='filings)
+            batch_size: number of chunks per add_texts upsert (type_of_data=='filings)
+            rate_limiter: limiter for ExtractorApi calls, defaults to the shared sec-api host limiter (type_of_data=='filings)
+            cik: company cik saved with web data (type_of_data in ['stock_info', 'news', 'web'])
+            stats: dict updated with counts of 'sections', 'skipped' (already indexed) and 'chunks' (type_of_data=='filings)
+            manifest: IngestionManifest recording the state of every (filing, section) of the collection (type_of_data=='filings)
+            max_retries: retries of a failed section fetch or batch upsert (type_of_data=='filings)
+            retry_backoff: base seconds of exponential backoff between retries (type_of_data=='filings)
+            chunker: SectionChunker for section text, default SectionChunker() (type_of_data=='filings)
+        Returns:
+            list[dict]: errors of failed tasks [{"url", "section", "stage", "error"}] (type_of_data=='filings)
         """
         if type_of_data == 'filings':
-            # Iterating for each filing
-            for filing in data:
-                filing_url = filing['url']
-                filing_date = filing['date']
-                
-                #Getting data for each section
-                for item in sections:
-                    # print("item:", item, "url", filing_url, "filing Date", filing_date, "desc", sections[item])
-                    try:
-                        uuids = []
-                        metadata_list = []
-                        section_desc = sections[item]
-                        
-                        #Using extractorAPI to fetch data of each section from the form
-                        section_text = extractorApi.get_section(filing_url=filing_url, section=item, return_type="text")
-                        split_texts = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150).split_text(section_text)
-                        for i in range(len(split_texts)):
-                            uuids.append(str(uuid4())) 
-                            metadata_list.append({
-                                "section": section_desc,
-                                "filing date": filing_date,
-                                "chunk_id": f"{i}",
-                            })
-                        vector_store.add_texts(texts=split_texts, metadatas=metadata_list, ids=uuids)
+            rate_limiter = rate_limiter or RateLimiter.for_host(EXTRACTOR_API_HOST)
+            chunker = chunker or SectionChunker()
+            errors = []
+            batch = {"texts": [], "metadatas": [], "ids": [], "tasks": [], "partial": []}
+            retry = {"max_retries": max_retries, "backoff": retry_backoff}
+            units = [(filing, item) for filing in data for item in sections]
+            indexed = set()
+            if manifest:
+                states = manifest.get_units(vector_store.collection_name, [filing.get('accession', filing['url']) for filing in data])
+                indexed = {(filing['url'], item) for filing, item in units
+                           if states.get((filing.get('accession', filing['url']), item), {}).get("state") == IngestionManifest.DONE}
+            # Sections in the collection but not in the manifest (ingested before the manifest or by another process),
+            # sections that failed are fetched again even if some of their chunks were upserted
+            found = self._get_indexed_sections(vector_store, [(filing, item) for filing, item in units if (filing['url'], item) not in indexed
+                                                              and (not manifest or (filing.get('accession', filing['url']), item) not in states)])
+            if manifest and found:
+                manifest.mark_done(vector_store.collection_name, [{"accession": filing.get('accession', filing['url']), "section": item, "url": filing['url']}
+                                                                  for filing, item in units if (filing['url'], item) in found])
+            indexed |= found
+            stats = stats if stats is not None else {}
+            for key in ("sections", "skipped", "chunks"):
+                stats.setdefault(key, 0)
+            stats["skipped"] += len(indexed)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # One task for each section of each filing not in the collection yet. Sections are fetched whole,
+                # at most 2 * max_workers section texts are submitted or waiting for chunking at a time
+                pending_units = iter([(filing, item) for filing, item in units if (filing['url'], item) not in indexed])
+                futures = {}
+                def submit_next():
+                    for filing, item in pending_units:
+                        futures[executor.submit(self._get_section, extractorApi, filing['url'], item, rate_limiter, retry)] = (filing, item)
+                        return
+                for _ in range(2 * max_workers):
+                    submit_next()
 
+                # Chunk each section as soon as it is fetched, upsert when batch is full
+                failed = set()
+                while futures:
+                    future = next(iter(wait(futures, return_when=FIRST_COMPLETED).done))
+                    filing, item = futures.pop(future)
+                    submit_next()
+                    try:
+                        section_text = future.result()
                     except Exception as e:
-                        print(f"Error fetching data for {filing_url} - {item} \n{e}")
-        elif type_of_data == 'stock_info':
-            vector_store.add_texts(texts=[data], metadatas=[{"details": "stock", "chunk_id": "0"}], ids=[str(uuid4())])
+                        errors.append({"url": filing['url'], "section": item, "stage": "fetch", "error": str(e)})
+                        if manifest:
+                            manifest.mark_failed(vector_store.collection_name, [{"accession": filing.get('accession', filing['url']), "section": item,
+                                                                                 "url": filing['url'], "error": f"fetch: {e}"}])
+                        continue
+
+                    task = {"accession": filing.get('accession', filing['url']), "section": item, "url": filing['url'],
+                            "content_hash": hashlib.sha256(section_text.encode("utf-8")).hexdigest(), "chunks": 0}
+                    # Chunks go into the batch as they are generated, a section can span several batches.
+                    # Chunk 0 is held back and added after the others, so it is upserted with the section's last batch
+                    # and marks the section as indexed (_get_indexed_sections) only once all its chunks are in the collection.
+                    first = None
+                    with tracer.span("ingest.split", bytes=len(section_text)) as span:
+                        for i, (chunk, chunk_type) in enumerate(chunker.chunks(section_text)):
+                            if i == 0:
+                                first = (chunk, chunk_type)
+                                continue
+                            self._add_chunk(batch, task, filing, item, sections[item], i, chunk, chunk_type)
+                            if len(batch["texts"]) >= batch_size:
+                                batch["partial"].append(task)
+                                failed |= self._get_failed(errors, self._flush_batch(vector_store, batch, manifest, retry))
+                        # A section with a failed batch is not marked as indexed, it is fetched again next run
+                        if first and (task["url"], item) not in failed:
+                            self._add_chunk(batch, task, filing, item, sections[item], 0, *first)
+                        span["chunks"] = task["chunks"]
+                    stats["sections"] += 1
+                    stats["chunks"] += task["chunks"]
+                    # Done once its last batch is upserted, unless an earlier batch with its chunks failed
+                    if (task["url"], item) not in failed:
+                        batch["tasks"].append(task)
+
+                    if len(batch["texts"]) >= batch_size:
+                        failed |= self._get_failed(errors, self._flush_batch(vector_store, batch, manifest, retry))
+                errors.extend(self._flush_batch(vector_store, batch, manifest, retry))
+
+            return errors
+        elif type_of_data == 'web':
+            # Stock info and news of all sources embedded and upserted in one batch
+            texts, metadatas, ids = [], [], []
+            source_ids = {}
+            for source, text in data.items():
+                source_texts, source_metadatas, source_ids[source] = self._get_web_chunks('stock_info' if source == 'stock_info' else 'news', text, cik, source)
+                texts.extend(source_texts)
+                metadatas.extend(source_metadatas)
+                ids.extend(source_ids[source])
+            if texts:
+                with tracer.span("ingest.add_texts", chunks=len(texts), bytes=sum(len(text) for text in texts)):
+                    vector_store.add_texts(texts=texts, metadatas=metadatas, ids=ids, batch_size=len(texts))
+                for source, point_ids in source_ids.items():
+                    self._delete_stale_web_points(vector_store, cik, source, point_ids)
+        elif type_of_data in ('stock_info', 'news'):
+            texts, metadatas, ids = self._get_web_chunks(type_of_data, data, cik)
+            vector_store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+            self._delete_stale_web_points(vector_store, cik, type_of_data, ids)
+
+    def _get_web_chunks(self, type_of_data: str, data: str, cik: str, source: str=None) -> tuple:
+        """
+        Texts, metadatas and point ids of stock info or news text
+        Point ids are keyed by (cik, source, chunk), so a new fetch of a source overwrites the previous one
+        Args:
+            source (str): web source of the text ('stock_info', 'news_gglnews', 'news_gglsrch'), type_of_data if None
+        Returns:
+            tuple: (texts, metadatas, ids)
+        """
+        source = source or type_of_data
+        if type_of_data == 'stock_info':
+            return [data], [{"details": "stock", "source": source, "chunk_id": "0", "cik": cik}], [self.get_point_id(cik, source, 0)]
         elif type_of_data == 'news':
             if len(data) > 1500:
                 split_texts = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150).split_text(data)
                 uuids, metadata_list = [], []
                 for i in range(len(split_texts)):
-                    uuids.append(str(uuid4())) 
+                    uuids.append(self.get_point_id(cik, source, i))
                     metadata_list.append({
                         "details": "news",
+                        "source": source,
                         "chunk_id": f"{i}",
+                        "cik": cik,
                     })
-                vector_store.add_texts(texts=split_texts, metadatas=metadata_list, ids=uuids)
+                return split_texts, metadata_list, uuids
             else:
-                vector_store.add_texts(texts=[data], metadatas=[{"details": "news"}], ids=[str(uuid4())])
+                return [data], [{"details": "news", "source": source, "cik": cik}], [self.get_point_id(cik, source, 0)]
+
+    def _delete_stale_web_points(self, vector_store: QdrantVectorStore, cik: str, source: str, point_ids: list):
+        """
+        Delete points of an earlier fetch of a web source for a company that the new fetch did not overwrite
+        (fewer news chunks, or points saved with content based ids before sources were recorded)
+        """
+        details = "stock" if source == "stock_info" else "news"
+        vector_store.client.delete(collection_name=vector_store.collection_name, points_selector=models.FilterSelector(filter=models.Filter(
+            must=[models.FieldCondition(key="metadata.cik", match=models.MatchValue(value=cik)),
+                  models.Filter(should=[models.FieldCondition(key="metadata.source", match=models.MatchValue(value=source)),
+                                        models.Filter(must=[models.FieldCondition(key="metadata.details", match=models.MatchValue(value=details)),
+                                                            models.IsEmptyCondition(is_empty=models.PayloadField(key="metadata.source"))])])],
+            must_not=[models.HasIdCondition(has_id=point_ids)])))
+
+    def _add_chunk(self, batch: dict, task: dict, filing: dict, item: str, section: str, chunk_no: int, chunk: str, chunk_type: str):
+        """
+        Add a chunk of a section to the pending batch with its point id and metadata
+        """
+        batch["ids"].append(self.get_point_id(task["accession"], item, chunk_no))
+        batch["metadatas"].append({
+            "section": section,
+            "filing date": filing['date'],
+            "chunk_id": f"{chunk_no}",
+            "cik": filing.get('cik'),
+            "accession": filing.get('accession'),
+            "year": int(filing['date'][:4]),
+            "chunk_type": chunk_type,
+        })
+        batch["texts"].append(chunk)
+        task["chunks"] += 1
+
+    def _get_indexed_sections(self, vector_store: QdrantVectorStore, units: list) -> set:
+        """
+        Get (filing url, section) pairs of the (filing, section) units already in the collection
+        A section's first chunk is upserted in its last batch, after all its other chunks, so it marks the section as indexed.
+        """
+        point_ids = {self.get_point_id(filing.get('accession', filing['url']), item, 0): (filing['url'], item) for filing, item in units}
+        if not point_ids:
+            return set()
+        points = vector_store.client.retrieve(collection_name=vector_store.collection_name, ids=list(point_ids), with_payload=False, with_vectors=False)
+        return {point_ids[str(point.id)] for point in points}
+
+    def _get_section(self, extractorApi: ExtractorApi, filing_url: str, section: str, rate_limiter: RateLimiter, retry: dict) -> str:
+        """
+        Fetch text of one section of a filing, waiting for the host rate limiter, with retries and exponential backoff
+        """
+        for attempt in range(retry["max_retries"] + 1):
+            try:
+                # Sections served from a local cache do not count against the host limit, extractors that
+                # call ExtractorApi only as a fallback (LocalExtractorApi) acquire the limiter themselves
+                if not (getattr(extractorApi, "acquires_rate_limit", False)
+                        or (hasattr(extractorApi, "is_cached") and extractorApi.is_cached(filing_url, section, "text"))):
+                    rate_limiter.acquire()
+                with tracer.span("ingest.get_section", section=section) as span:
+                    section_text = extractorApi.get_section(filing_url=filing_url, section=section, return_type="text")
+                    span["bytes"] = len(section_text)
+                return section_text
+            except Exception:
+                if attempt == retry["max_retries"]:
+                    raise
+                tracer.count("ingest.retries")
+                time.sleep(retry["backoff"] * 2 ** attempt)
+
+    def _get_failed(self, errors: list, batch_errors: list) -> set:
+        """
+        Add errors of a flushed batch to errors
+        Returns:
+            set: (url, section) of the failed tasks
+        """
+        errors.extend(batch_errors)
+        return {(error["url"], error["section"]) for error in batch_errors}
+
+    def _flush_batch(self, vector_store: QdrantVectorStore, batch: dict, manifest: IngestionManifest, retry: dict) -> list:
+        """
+        Embed and upsert pending chunks of the batch with retries, record the outcome in the manifest and reset the batch
+        Sections with only some of their chunks in the batch (partial) are recorded when they fail, as done with their last chunk.
+        Returns:
+            list[dict]: errors for every (filing, section) task in the batch if upsert failed
+        """
+        errors = []
+        for attempt in range(retry["max_retries"] + 1 if batch["texts"] else 0):
+            try:
+                # Whole batch in one embedding request (add_texts embeds 64 texts at a time by default)
+                with tracer.span("ingest.add_texts", chunks=len(batch["texts"]), bytes=sum(len(text) for text in batch["texts"])):
+                    vector_store.add_texts(texts=batch["texts"], metadatas=batch["metadatas"], ids=batch["ids"], batch_size=len(batch["texts"]))
+                if manifest:
+                    manifest.mark_done(vector_store.collection_name, batch["tasks"])
+                break
+            except Exception as e:
+                if attempt < retry["max_retries"]:
+                    tracer.count("ingest.retries")
+                    time.sleep(retry["backoff"] * 2 ** attempt)
+                    continue
+                tasks = batch["tasks"] + batch.get("partial", [])
+                errors = [{"url": task["url"], "section": task["section"], "stage": "upsert", "error": str(e)} for task in tasks]
+                if manifest:
+                    manifest.mark_failed(vector_store.collection_name, [{**task, "error": f"upsert: {e}"} for task in tasks])
+        for key in batch:
+            batch[key] = []
+        return errors
@@ -0,0 +1,52 @@
+import time
+import threading
+from urllib.parse import urlparse
+
+class RateLimiter:
+    # Shared limiters per host so every caller talking to the same host draws from one bucket
+    _hosts = {}
+    _hosts_lock = threading.Lock()
+
+    def __init__(self, rate: float=10, burst: int=None):
+        """
+        Token bucket rate limiter, safe to share between threads
+        Args:
+            rate (float): tokens refilled per second (requests/second)
+            burst (int): max tokens in the bucket (defaults to rate)
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_host(cls, host: str, rate: float=10, burst: int=None) -> "RateLimiter":
+        """
+        Get (or create) the shared rate limiter for a host
+        Args:
+            host (str): host name or full url ('www.sec.gov', 'https://api.sec-api.io/extractor')
+            rate, burst: used only when the limiter for the host is created
+        Returns:
+            RateLimiter: limiter shared by all callers of the host
+        """
+        host = urlparse(host).netloc or host
+        with cls._hosts_lock:
+            if host not in cls._hosts:
+                cls._hosts[host] = cls(rate=rate, burst=burst)
+            return cls._hosts[host]
+
+    def acquire(self, tokens: float=1):
+        """
+        Block until 'tokens' are available in the bucket and take them
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
@@ -1,20 +1,88 @@
-
-import yfinance as yf
+import time
+import threading
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from tracing import tracer
 
 class Scraper:
+    # Seconds results are reused for the same ticker: quotes for a few minutes, news for longer
+    CACHE_TTL = {"stock_info": 5 * 60, "news_gglnews": 30 * 60, "news_gglsrch": 30 * 60}
+    # Seconds each source may take in get_web_data
+    DEADLINES = {"stock_info": 10, "news_gglnews": 8, "news_gglsrch": 8}
+    _cache = {}
+    _cache_lock = threading.Lock()
+    _session = None
+    _session_lock = threading.Lock()
+
     def __init__(self, ticker: str, company_name: str):
         self.ticker = ticker
         self.company_name = company_name
 
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        """
+        HTTP session with a keep-alive connection pool shared by all scrapers
+        """
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                cls._session.mount("https://", adapter)
+                cls._session.mount("http://", adapter)
+            return cls._session
+
+    def _get_cached(self, source: str, fetch) -> str:
+        """
+        Result of fetch() for (ticker, source) from the TTL cache, fetched and cached on a miss
+        """
+        key = (self.ticker, source)
+        with self._cache_lock:
+            expires, value = self._cache.get(key, (0, None))
+        if time.time() < expires:
+            tracer.count("web.cache_hits")
+            return value
+        with tracer.span(f"web.{source}"):
+            value = fetch()
+        with self._cache_lock:
+            self._cache[key] = (time.time() + self.CACHE_TTL[source], value)
+        return value
+
+    def get_web_data(self, sources: tuple=("stock_info", "news_gglnews", "news_gglsrch")) -> dict:
+        """
+        Fetch stock info and news concurrently, each source within its deadline (DEADLINES)
+        A slow or failing source is left out without holding up the others, it still fills the cache when it completes.
+        Args:
+            sources (tuple): sources to fetch ('stock_info', 'news_gglnews', 'news_gglsrch')
+        Returns:
+            dict: {source: text} of sources fetched in time, e.g. {"stock_info": "...", "news_gglnews": "..."}
+        """
+        fetchers = {"stock_info": self.get_stock_info, "news_gglnews": self.get_finance_news_gglnews, "news_gglsrch": self.get_finance_news_gglsrch}
+        start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=len(sources))
+        futures = {source: executor.submit(self._get_cached, source, fetchers[source]) for source in sources}
+        web_data = {}
+        for source, future in futures.items():
+            try:
+                web_data[source] = future.result(timeout=max(0, start + self.DEADLINES[source] - time.monotonic()))
+            except TimeoutError:
+                tracer.count("web.timeouts")
+                print(f"{source} for {self.ticker} timed out")
+            except Exception as e:
+                tracer.count("web.errors")
+                print(f"{source} for {self.ticker} failed: {e}")
+        executor.shutdown(wait=False)
+        return web_data
+
     def get_stock_info(self) -> str:
         """
         Using yahoo finance to get latest stock price of 5 last days
         based on self.ticker(str): Company ticker
         """
+        # Imported here so yfinance (and pandas) are loaded only when web data is searched
+        import yfinance as yf
         latest_period = "5d" # Valid periods: ['1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max']
-        stock_info = yf.Ticker(self.ticker).history(period=latest_period)
+        stock_info = yf.Ticker(self.ticker).history(period=latest_period, timeout=self.DEADLINES["stock_info"])
         if not stock_info.empty:
             stock_mrkdwn = stock_info.to_markdown() 
             return f"The stock price history of {self.company_name} for last 5 days is:\n {stock_mrkdwn}"
@@ -26,8 +94,9 @@ class Scraper:
         Scrape latest news headlines from the google news
         based on "company_name finance"
         """
+        from bs4 import BeautifulSoup
         url = f"https://news.google.com/search?q={self.company_name.replace(' ','+')}+finance"
-        response = requests.get(url)
+        response = self.get_session().get(url, timeout=self.DEADLINES["news_gglnews"])
         soup = BeautifulSoup(response.text, 'html.parser')
         news_items = soup.find_all('a', class_='JtKRv')
 
@@ -45,9 +114,10 @@ class Scraper:
         Scrape latest news headlines and details from the google search 50 results
         by searching: ""company_name" finance news" > News tab
         """
+        from bs4 import BeautifulSoup
         top_n_results = 50
         url = f"https://www.google.com/search?&q=%22{self.company_name.replace(' ','+')}%22+finance+news&tbm=nws&num={top_n_results}"
-        response = requests.get(url)
+        response = self.get_session().get(url, timeout=self.DEADLINES["news_gglsrch"])
         soup = BeautifulSoup(response.text, 'html.parser')
         news_items = soup.find_all('h3')
 
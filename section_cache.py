@@ -0,0 +1,143 @@
+import os
+import re
+import zlib
+import hashlib
+import threading
+from sec_api import ExtractorApi
+
+class SectionCache:
+    def __init__(self, cache_dir: str=".cache/sections", max_bytes: int=512 * 1024 * 1024):
+        """
+        Persistent cache of 10-K section text on local disk
+        Entries are zlib compressed files named by a hash of (accession number, item, return type).
+        Filed 10-K text never changes, so entries never expire and are only evicted
+        least recently used first once the cache grows beyond max_bytes.
+        Args:
+            cache_dir (str): directory to store cached sections
+            max_bytes (int): max size of the cache on disk (compressed)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith(".z"))
+
+    def get_key(self, filing_url: str, section: str, return_type: str="text") -> str:
+        """
+        Cache key for a section of a filing
+        Accession number is used when the url is an EDGAR archive url, so the same filing shares entries across urls
+            'https://www.sec.gov/Archives/edgar/data/320193/000032019323000106/aapl-20230930.htm' -> '000032019323000106'
+        """
+        accession = re.search(r"/edgar/data/\d+/(\d{18})/", filing_url)
+        filing_key = accession.group(1) if accession else filing_url
+        return hashlib.sha256(f"{filing_key}|{section}|{return_type}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.z")
+
+    def contains(self, filing_url: str, section: str, return_type: str="text") -> bool:
+        """
+        Check if section is cached without counting a hit/miss
+        """
+        return os.path.exists(self._path(self.get_key(filing_url, section, return_type)))
+
+    def get(self, filing_url: str, section: str, return_type: str="text"):
+        """
+        Get cached section text
+        Returns:
+            str: section text, None if not cached
+        """
+        path = self._path(self.get_key(filing_url, section, return_type))
+        try:
+            with open(path, "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+            # Modified time is the last used time for LRU eviction
+            os.utime(path)
+        except (OSError, zlib.error):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return text
+
+    def set(self, filing_url: str, section: str, text: str, return_type: str="text"):
+        """
+        Save section text to cache and evict least recently used entries over max_bytes
+        """
+        path = self._path(self.get_key(filing_url, section, return_type))
+        data = zlib.compress(text.encode("utf-8"), 6)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+            self.size += len(data) - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used entries until cache is within max_bytes (called with lock held)
+        """
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.cache_dir) if entry.name.endswith(".z"))
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Cache statistics
+        Returns:
+            dict: {hits, misses, hit_rate, evictions, entries, size_bytes}
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions,
+                    "entries": sum(1 for entry in os.scandir(self.cache_dir) if entry.name.endswith(".z")),
+                    "size_bytes": self.size,}
+
+
+class CachedExtractorApi:
+    def __init__(self, extractorApi: ExtractorApi, cache: SectionCache):
+        """
+        ExtractorApi with a persistent SectionCache in front of get_section
+        Args:
+            extractorApi: sec-api ExtractorApi (or any object with get_section)
+            cache: SectionCache to serve sections from
+        """
+        self.extractorApi = extractorApi
+        self.cache = cache
+        # Misses are fetched by the wrapped extractor, which may rate limit its own sec-api calls (LocalExtractorApi)
+        self.acquires_rate_limit = getattr(extractorApi, "acquires_rate_limit", False)
+
+    def is_cached(self, filing_url: str, section: str, return_type: str="text") -> bool:
+        """
+        Check if get_section will be served from the cache (or from a document already parsed by the wrapped extractor)
+        """
+        if self.cache.contains(filing_url, section, return_type):
+            return True
+        return hasattr(self.extractorApi, "is_cached") and self.extractorApi.is_cached(filing_url, section, return_type)
+
+    def get_section(self, filing_url: str, section: str, return_type: str="text") -> str:
+        """
+        Get section text from cache, fetch with ExtractorApi and cache it on a miss
+        """
+        text = self.cache.get(filing_url, section, return_type)
+        if text is None:
+            text = self.extractorApi.get_section(filing_url=filing_url, section=section, return_type=return_type)
+            self.cache.set(filing_url, section, text, return_type)
+        return text
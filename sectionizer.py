@@ -0,0 +1,211 @@
+import re
+import codecs
+import threading
+import requests
+from collections import OrderedDict
+from html.parser import HTMLParser
+from ratelimiter import RateLimiter
+from sec_api import ExtractorApi
+from tracing import tracer
+from edgar_client import EdgarClient
+
+# All Items of a 10-K in filing order, used to find section boundaries
+ITEMS_10K = ['1', '1A', '1B', '1C', '2', '3', '4', '5', '6', '7', '7A', '8', '9', '9A', '9B', '9C', '10', '11', '12', '13', '14', '15', '16']
+ITEM_HEADING = re.compile(r"^\s*item\s*(\d{1,2}[a-c]?)\s*(?:[\.:\-–—]|$|\s)", re.IGNORECASE)
+PART_HEADING = re.compile(r"^\s*part\s+(i|ii|iii|iv)\s*$", re.IGNORECASE)
+SIGNATURES_HEADING = re.compile(r"^\s*signatures?\s*$", re.IGNORECASE)
+
+class _TextExtractor(HTMLParser):
+    # Tags that start a new line of text
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'table', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'center'}
+    CELL_TAGS = {'td', 'th'}
+    # Tags whose content is never part of the filing text (inline XBRL header holds hidden facts)
+    SKIP_TAGS = {'script', 'style', 'head', 'title', 'ix:header'}
+
+    def __init__(self):
+        """
+        Incremental html to text parser, completed lines are collected in self.lines
+        """
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.line = []
+        self.skip_tag = None
+        self.skip_depth = 0
+
+    def _end_line(self):
+        text = re.sub(r"\s+", " ", "".join(self.line)).strip()
+        if text:
+            self.lines.append(text)
+        self.line = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_tag:
+            self.skip_depth += tag == self.skip_tag
+            return
+        style = (dict(attrs).get('style') or '').replace(' ', '').lower()
+        if tag in self.SKIP_TAGS or 'display:none' in style:
+            self.skip_tag, self.skip_depth = tag, 1
+            return
+        if tag in self.BLOCK_TAGS:
+            self._end_line()
+        elif tag in self.CELL_TAGS and self.line:
+            self.line.append("  ")
+
+    def handle_endtag(self, tag):
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    self.skip_tag = None
+            return
+        if tag in self.BLOCK_TAGS:
+            self._end_line()
+
+    def handle_data(self, data):
+        if not self.skip_tag:
+            self.line.append(data)
+
+    def close(self):
+        super().close()
+        self._end_line()
+
+
+class Sectionizer10K:
+
+    def split(self, html_chunks, min_items: int=5) -> dict:
+        """
+        Split a 10-K primary html document into its Items
+        The table of contents lists every Item heading too, so for each Item the heading
+        followed by the longest text is taken as the start of the section.
+        Args:
+            html_chunks (Iterable[str]): html document as a stream of text chunks
+            min_items (int): min number of Items to find, else the document is not parsed as a 10-K
+        Returns:
+            dict: {item: section text} e.g. {'1A': 'Item 1A. Risk Factors ...'}, empty dict if parsing failed
+        """
+        parser = _TextExtractor()
+        for chunk in html_chunks:
+            parser.feed(chunk)
+        parser.close()
+        lines = parser.lines
+
+        # All line numbers starting with an Item heading
+        headings = []
+        for line_no, line in enumerate(lines):
+            match = ITEM_HEADING.match(line)
+            if match and match.group(1).upper() in ITEMS_10K:
+                headings.append((line_no, match.group(1).upper()))
+        if not headings:
+            return {}
+
+        # Pick the occurrence of each Item with the longest text until the next heading
+        heading_ends = [line_no for line_no, _ in headings[1:]] + [len(lines)]
+        starts = {}
+        for (line_no, item), end in zip(headings, heading_ends):
+            length = sum(len(line) for line in lines[line_no:end])
+            if item not in starts or length > starts[item][1]:
+                starts[item] = (line_no, length)
+        if len(starts) < min_items:
+            return {}
+
+        # Section ends at the start of the next section (or at signatures for the last one)
+        ordered_starts = sorted(line_no for line_no, _ in starts.values())
+        signatures = next((line_no for line_no in range(ordered_starts[-1], len(lines)) if SIGNATURES_HEADING.match(lines[line_no])), len(lines))
+        sections = {}
+        for item, (start, _) in starts.items():
+            end = next((line_no for line_no in ordered_starts if line_no > start), signatures)
+            section_lines = lines[start:end]
+            # 'PART II' heading before the next Item belongs to the next part
+            while section_lines and PART_HEADING.match(section_lines[-1]):
+                section_lines.pop()
+            sections[item] = "\n".join(section_lines)
+        return sections
+
+
+class LocalExtractorApi:
+    # get_section acquires the sec-api host limiter itself, only for fallback calls, callers do not acquire it
+    acquires_rate_limit = True
+
+    def __init__(self, headers: dict, fallback: ExtractorApi=None, max_documents: int=16, client: EdgarClient=None):
+        """
+        Drop-in for ExtractorApi.get_section that downloads each 10-K primary document once from sec.gov
+        and splits it into Items locally. ExtractorApi is used as fallback for documents (or Items) the
+        sectionizer cannot find and for non text return types.
+        Args:
+            headers (dict): headers for request to sec.gov (User-Agent required by EDGAR)
+            fallback (ExtractorApi): sec-api extractor used when local parsing fails
+            max_documents (int): number of parsed documents kept in memory
+            client (EdgarClient): shared EDGAR http client, created from headers if not provided
+        """
+        self.headers = headers
+        self.fallback = fallback
+        self.max_documents = max_documents
+        self.client = client or EdgarClient(headers)
+        self.sectionizer = Sectionizer10K()
+        self.fallback_rate_limiter = RateLimiter.for_host("api.sec-api.io")
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+        self.url_locks = {}
+
+    def _get_document(self, filing_url: str) -> dict:
+        """
+        Get parsed Items of a filing, downloading and parsing it only once for concurrent callers
+        Raises:
+            requests.RequestException: download failed (not cached, so a retry downloads it again)
+        """
+        with self.lock:
+            if filing_url in self.documents:
+                self.documents.move_to_end(filing_url)
+                return self.documents[filing_url]
+            url_lock = self.url_locks.setdefault(filing_url, threading.Lock())
+
+        with url_lock:
+            with self.lock:
+                if filing_url in self.documents:
+                    return self.documents[filing_url]
+            # A failed download is not cached, the caller retries it. Only a parsed document without Items is cached empty
+            try:
+                with self.client.get(url=filing_url, stream=True) as response:
+                    response.raise_for_status()
+                    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+                    chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=64 * 1024))
+                    sections = self.sectionizer.split(chunks)
+            except requests.RequestException:
+                with self.lock:
+                    self.url_locks.pop(filing_url, None)
+                raise
+
+            with self.lock:
+                self.documents[filing_url] = sections
+                self.url_locks.pop(filing_url, None)
+                while len(self.documents) > self.max_documents:
+                    self.documents.popitem(last=False)
+            return sections
+
+    def is_cached(self, filing_url: str, section: str, return_type: str="text") -> bool:
+        """
+        Check if the section is in a document already downloaded and parsed
+        """
+        if return_type != "text":
+            return False
+        with self.lock:
+            sections = self.documents.get(filing_url)
+        return sections is not None and section in sections
+
+    def get_section(self, filing_url: str, section: str, return_type: str="text") -> str:
+        """
+        Get text of a section of the filing, same as ExtractorApi.get_section
+        Args:
+            filing_url (str): url of the 10-K primary document
+            section (str): Item code ('1', '1A', '7', ...)
+            return_type (str): 'text' (parsed locally) or 'html' (ExtractorApi)
+        """
+        if return_type == "text":
+            sections = self._get_document(filing_url)
+            if section in sections:
+                return sections[section]
+        if self.fallback is None:
+            raise ValueError(f"Item {section} not found in {filing_url}")
+        self.fallback_rate_limiter.acquire()
+        tracer.count("sec_api.calls")
+        return self.fallback.get_section(filing_url=filing_url, section=section, return_type=return_type)
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import List, Sequence
+from tracing import tracer
+from qdrant_client import QdrantClient
+from ingestion_manifest import IngestionManifest
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+
+class SessionStore:
+    def __init__(self, path: str=".cache/sessions.sqlite", max_turns: int=100, touch_interval: float=60):
+        """
+        On-disk store of chat sessions and their Qdrant collections, shared by all sessions of the app
+        Messages are rows numbered by turn (a question and its answer), so reads load only the last n turns
+        and the process keeps no history in memory. Each session keeps at most max_turns turns on disk.
+        Collections created for a session are registered with their last use, a background reaper
+        (start_reaper) deletes collections and chat histories that were not used for a while.
+        Args:
+            path (str): sqlite file of the store
+            max_turns (int): turns kept per session, older turns are deleted
+            touch_interval (float): min seconds between two last-use updates of a collection or session
+        """
+        self.max_turns = max_turns
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        self.reaper = None
+        self.stop_event = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (message_no INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, turn INTEGER, message TEXT, created REAL);
+            CREATE INDEX IF NOT EXISTS messages_session_turn ON messages (session_id, turn);
+            CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, turns INTEGER, created REAL, last_used REAL);
+            CREATE TABLE IF NOT EXISTS collections (collection TEXT PRIMARY KEY, session_id TEXT, created REAL, last_used REAL);
+        """)
+        self.connection.commit()
+
+    def get_history(self, session_id: str, last_n_turns: int=None) -> "SessionChatMessageHistory":
+        """
+        Chat history of a session for RunnableWithMessageHistory, reading only the last_n_turns turns (all if None)
+        """
+        return SessionChatMessageHistory(self, session_id, last_n_turns)
+
+    def get_messages(self, session_id: str, last_n_turns: int=None) -> List[BaseMessage]:
+        """
+        Messages of the last n turns of a session, oldest first
+        """
+        with self.lock:
+            if last_n_turns is None:
+                rows = self.connection.execute("SELECT message FROM messages WHERE session_id = ? ORDER BY message_no", (session_id,)).fetchall()
+            else:
+                rows = self.connection.execute("""SELECT message FROM messages WHERE session_id = ?
+                                                  AND turn > (SELECT COALESCE(MAX(turn), 0) FROM messages WHERE session_id = ?) - ? ORDER BY message_no""",
+                                               (session_id, session_id, last_n_turns)).fetchall()
+        return messages_from_dict([json.loads(message) for message, in rows])
+
+    def add_messages(self, session_id: str, messages: Sequence[BaseMessage]):
+        """
+        Append messages to a session, a HumanMessage starts a new turn
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT turns FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            turn = row[0] if row else 0
+            rows = []
+            for message in messages:
+                if isinstance(message, HumanMessage) or turn == 0:
+                    turn += 1
+                rows.append((session_id, turn, json.dumps(message_to_dict(message), separators=(",", ":")), now))
+            self.connection.executemany("INSERT INTO messages (session_id, turn, message, created) VALUES (?, ?, ?, ?)", rows)
+            self.connection.execute("""INSERT INTO sessions VALUES (?, ?, ?, ?)
+                                       ON CONFLICT (session_id) DO UPDATE SET turns = excluded.turns, last_used = excluded.last_used""", (session_id, turn, now, now))
+            self.connection.execute("DELETE FROM messages WHERE session_id = ? AND turn <= ?", (session_id, turn - self.max_turns))
+            self.connection.commit()
+
+    def clear(self, session_id: str):
+        """
+        Delete the chat history of a session
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self.connection.commit()
+
+    def register_collection(self, collection: str, session_id: str):
+        """
+        Record a Qdrant collection created for a session, it is deleted by the reaper once idle
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("""INSERT INTO collections VALUES (?, ?, ?, ?)
+                                       ON CONFLICT (collection) DO UPDATE SET last_used = excluded.last_used""", (collection, session_id, now, now))
+            self.connection.commit()
+
+    def touch_collection(self, collection: str) -> bool:
+        """
+        Mark a collection as used (at most every touch_interval seconds)
+        Returns:
+            bool: False if the collection is not registered (deleted by the reaper)
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT last_used FROM collections WHERE collection = ?", (collection,)).fetchone()
+            if row is None:
+                return False
+            if now - row[0] >= self.touch_interval:
+                self.connection.execute("UPDATE collections SET last_used = ? WHERE collection = ?", (now, collection))
+                self.connection.commit()
+        return True
+
+    def reap(self, qdrant_client: QdrantClient, max_idle: float, history_max_age: float=None, manifest: IngestionManifest=None) -> dict:
+        """
+        Delete collections not used for max_idle seconds (Qdrant collection, manifest units and registry entry)
+        and chat histories of sessions not used for history_max_age seconds
+        Returns:
+            dict: {"collections": int, "sessions": int} deleted
+        """
+        now = time.time()
+        with self.lock:
+            idle = [collection for collection, in self.connection.execute("SELECT collection FROM collections WHERE last_used < ?", (now - max_idle,)).fetchall()]
+        deleted = {"collections": 0, "sessions": 0}
+        for collection in idle:
+            try:
+                qdrant_client.delete_collection(collection_name=collection)
+            except Exception as e:
+                print(f"Deleting collection {collection} failed: {e}")
+                continue
+            if manifest is not None:
+                manifest.forget(collection)
+            with self.lock:
+                self.connection.execute("DELETE FROM collections WHERE collection = ?", (collection,))
+                self.connection.commit()
+            deleted["collections"] += 1
+        if history_max_age is not None:
+            with self.lock:
+                sessions = [session_id for session_id, in self.connection.execute("SELECT session_id FROM sessions WHERE last_used < ?", (now - history_max_age,)).fetchall()]
+                for session_id in sessions:
+                    self.connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                    self.connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self.connection.commit()
+            deleted["sessions"] = len(sessions)
+        tracer.count("sessions.collections_reaped", deleted["collections"])
+        tracer.count("sessions.histories_reaped", deleted["sessions"])
+        return deleted
+
+    def start_reaper(self, qdrant_client: QdrantClient, max_idle: float=6 * 60 * 60, history_max_age: float=30 * 24 * 60 * 60,
+                     manifest: IngestionManifest=None, interval: float=10 * 60):
+        """
+        Run reap every interval seconds on a daemon thread (once per store)
+        """
+        if self.reaper is not None:
+            return
+        def run():
+            while not self.stop_event.wait(interval):
+                try:
+                    with tracer.span("sessions.reap"):
+                        self.reap(qdrant_client, max_idle, history_max_age, manifest)
+                except Exception as e:
+                    print(f"Session reaper failed: {e}")
+        self.reaper = threading.Thread(target=run, name="session-reaper", daemon=True)
+        self.reaper.start()
+
+    def stop_reaper(self):
+        self.stop_event.set()
+
+    def stats(self) -> dict:
+        """
+        Number of sessions, stored messages and registered collections
+        """
+        with self.lock:
+            return {"sessions": self.connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                    "messages": self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+                    "collections": self.connection.execute("SELECT COUNT(*) FROM collections").fetchone()[0]}
+
+
+class SessionChatMessageHistory(BaseChatMessageHistory):
+    def __init__(self, store: SessionStore, session_id: str, last_n_turns: int=None):
+        """
+        Chat history of a session in the SessionStore, messages are read from disk on access
+        Args:
+            last_n_turns (int): only the last n turns are read (all if None)
+        """
+        self.store = store
+        self.session_id = session_id
+        self.last_n_turns = last_n_turns
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.get_messages(self.session_id, self.last_n_turns)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.add_messages(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
@@ -0,0 +1,193 @@
+import json
+import time
+import threading
+from uuid import UUID
+from collections import deque
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+class Tracer:
+    def __init__(self, max_spans: int=10_000):
+        """
+        Timed spans and counters of the fetch -> embed -> retrieve -> generate path
+        Args:
+            max_spans (int): number of most recent spans kept in memory
+        """
+        self.spans = deque(maxlen=max_spans)
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Time a block of code, numeric attributes (bytes, chunks, tokens) can be set on the yielded dict
+            with tracer.span("ingest.add_texts", chunks=len(texts)) as span:
+                ...
+                span["bytes"] = n
+        """
+        start = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(name, start, time.perf_counter() - started, attributes, error)
+
+    def record(self, name: str, start: float, duration: float, attributes: dict=None, error: str=None):
+        """
+        Record a finished span
+        """
+        with self.lock:
+            self.spans.append({"name": name, "start": start, "duration": duration, "attributes": attributes or {}, "error": error})
+
+    def count(self, name: str, value: float=1):
+        """
+        Increment a counter (api calls, bytes, tokens, ...)
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> list:
+        """
+        Aggregates per span name
+        Returns:
+            list[dict]: [{span, count, errors, total_s, avg_ms, p95_ms, max_ms, <attribute totals>}]
+        """
+        with self.lock:
+            spans = list(self.spans)
+        grouped = {}
+        for span in spans:
+            grouped.setdefault(span["name"], []).append(span)
+        summary = []
+        for name, group in sorted(grouped.items()):
+            durations = sorted(span["duration"] for span in group)
+            row = {"span": name,
+                   "count": len(group),
+                   "errors": sum(1 for span in group if span["error"]),
+                   "total_s": sum(durations),
+                   "avg_ms": sum(durations) / len(durations) * 1000,
+                   "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+                   "max_ms": durations[-1] * 1000,}
+            for span in group:
+                for key, value in span["attributes"].items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        row[key] = row.get(key, 0) + value
+            summary.append(row)
+        return summary
+
+    def export_jsonl(self) -> str:
+        """
+        Spans and counters as json lines
+        """
+        with self.lock:
+            lines = [json.dumps({"type": "span", **span}, default=str) for span in self.spans]
+            lines.extend(json.dumps({"type": "counter", "name": name, "value": value}) for name, value in self.counters.items())
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, prefix: str="sec_chatbot") -> str:
+        """
+        Span summaries and counters in Prometheus text exposition format
+        """
+        lines = [f"# TYPE {prefix}_span_seconds summary"]
+        attribute_lines = [f"# TYPE {prefix}_span_attribute_total counter"]
+        for row in self.summary():
+            lines.append(f'{prefix}_span_seconds_count{{span="{row["span"]}"}} {row["count"]}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{row["span"]}"}} {row["total_s"]}')
+            for key, value in row.items():
+                if key not in ("span", "count", "errors", "total_s", "avg_ms", "p95_ms", "max_ms"):
+                    attribute_lines.append(f'{prefix}_span_attribute_total{{span="{row["span"]}",attribute="{key}"}} {value}')
+        lines.extend(attribute_lines)
+        lines.append(f"# TYPE {prefix}_total counter")
+        with self.lock:
+            lines.extend(f'{prefix}_total{{name="{name}"}} {value}' for name, value in sorted(self.counters.items()))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    # Names of the history aware retriever chain (create_retrieval_chain renames it), LLM calls inside it are the standalone question rewrite
+    REWRITE_CHAINS = {"chat_retriever_chain", "retrieve_documents"}
+
+    def __init__(self, tracer: Tracer):
+        """
+        LangChain callback handler recording spans of the rag chain stages
+            llm.rewrite: standalone question generation, retrieve: vector search, llm.generate: answer generation
+        Pass in the runnable config: {"callbacks": [TracingCallbackHandler(tracer)]}
+        """
+        self.tracer = tracer
+        self.parents = {}
+        self.names = {}
+        self.starts = {}
+
+    def _stage(self, run_id: UUID) -> str:
+        parent = self.parents.get(run_id)
+        while parent is not None:
+            if self.names.get(parent) in self.REWRITE_CHAINS:
+                return "llm.rewrite"
+            parent = self.parents.get(parent)
+        return "llm.generate"
+
+    def _start(self, run_id: UUID, parent_run_id: UUID, name: str=None):
+        self.parents[run_id] = parent_run_id
+        self.names[run_id] = name
+        self.starts[run_id] = (time.time(), time.perf_counter())
+
+    def _end(self, run_id: UUID, name: str, attributes: dict=None, error: str=None):
+        start, started = self.starts.pop(run_id, (time.time(), time.perf_counter()))
+        if name:
+            self.tracer.record(name, start, time.perf_counter() - started, attributes, error)
+        self.parents.pop(run_id, None)
+        self.names.pop(run_id, None)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name"))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, None)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id)
+        self.names[run_id] = self._stage(run_id)
+        self.tracer.count("llm.calls")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        # Token usage: llm_output of OpenAI completions, usage_metadata of chat messages (Groq)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        tokens = {"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0)}
+        for generations in response.generations:
+            for generation in generations:
+                message_usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                tokens["prompt_tokens"] += message_usage.get("input_tokens", 0)
+                tokens["completion_tokens"] += message_usage.get("output_tokens", 0)
+        for key, value in tokens.items():
+            self.tracer.count(f"llm.{key}", value)
+        self._end(run_id, self.names.get(run_id), tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, self.names.get(run_id), error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "retrieve")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, "retrieve", {"documents": len(documents), "bytes": sum(len(document.page_content) for document in documents)})
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "retrieve", error=type(error).__name__)
+
+
+# Process wide tracer
+tracer = Tracer()
@@ -0,0 +1,381 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+from tracing import tracer
+from edgar_client import EdgarClient
+from langchain_core.documents import Document
+
+# Metrics asked in questions: (pattern, label, concepts in order of preference)
+# Filers switch concepts over the years (e.g. SalesRevenueNet -> RevenueFromContractWithCustomerExcludingAssessedTax), a metric's series takes each year from the first concept reporting it.
+METRICS = [
+    (r"\bnet (income|earnings|profit)\b|\bnet loss\b", "Net income", ["us-gaap:NetIncomeLoss", "us-gaap:ProfitLoss", "us-gaap:NetIncomeLossAvailableToCommonStockholdersBasic"]),
+    (r"\bgross (profit|margin)\b", "Gross profit", ["us-gaap:GrossProfit"]),
+    (r"\boperating (income|profit|loss)\b", "Operating income", ["us-gaap:OperatingIncomeLoss"]),
+    (r"\b(diluted )?(eps|earnings per share)\b", "Diluted EPS", ["us-gaap:EarningsPerShareDiluted", "us-gaap:EarningsPerShareBasic"]),
+    (r"\b(research and development|r&d)\b", "Research and development expense", ["us-gaap:ResearchAndDevelopmentExpense", "us-gaap:ResearchAndDevelopmentExpenseExcludingAcquiredInProcessCost"]),
+    (r"\boperating cash flows?\b|\bcash (flows? )?from operati", "Operating cash flow", ["us-gaap:NetCashProvidedByUsedInOperatingActivities"]),
+    (r"\b(capex|capital expenditures?)\b", "Capital expenditures", ["us-gaap:PaymentsToAcquirePropertyPlantAndEquipment"]),
+    (r"\bcost of (revenues?|sales|goods sold)\b", "Cost of revenue", ["us-gaap:CostOfGoodsAndServicesSold", "us-gaap:CostOfRevenue", "us-gaap:CostOfGoodsSold"]),
+    (r"(?<!deferred )\b(revenues?|net sales|total sales)\b", "Revenue", ["us-gaap:RevenueFromContractWithCustomerExcludingAssessedTax", "us-gaap:Revenues", "us-gaap:SalesRevenueNet",
+                                                                   "us-gaap:RevenueFromContractWithCustomerIncludingAssessedTax"]),
+    (r"\btotal assets\b", "Total assets", ["us-gaap:Assets"]),
+    (r"\btotal liabilities\b", "Total liabilities", ["us-gaap:Liabilities"]),
+    (r"\b(shareholders|stockholders)'? equity\b", "Stockholders' equity", ["us-gaap:StockholdersEquity", "us-gaap:StockholdersEquityIncludingPortionAttributableToNoncontrollingInterest"]),
+    (r"\bcash and cash equivalents\b|\bcash (balance|position)\b", "Cash and cash equivalents", ["us-gaap:CashAndCashEquivalentsAtCarryingValue", "us-gaap:CashCashEquivalentsRestrictedCashAndRestrictedCashEquivalents"]),
+    (r"\blong[- ]term debt\b", "Long-term debt", ["us-gaap:LongTermDebtNoncurrent", "us-gaap:LongTermDebt"]),
+    (r"\bshares outstanding\b", "Shares outstanding", ["dei:EntityCommonStockSharesOutstanding", "us-gaap:CommonStockSharesOutstanding"]),
+]
+# Questions asking for figures, and questions about the narrative around them (answered from the filings' text)
+NUMERIC_QUESTION = re.compile(r"\b(how much|how many|what (was|were|is|are)|growth|grow|grew|change|changed|increase|increased|decrease|decreased|decline|declined|"
+                              r"average|total|sum|compare|trend|figures?|amount|numbers?|values?|report|reported)\b", re.IGNORECASE)
+NARRATIVE_QUESTION = re.compile(r"\b(why|explain\w*|describ\w*|discuss\w*|attribut\w*|dr(ive[ns]?|ove|iving)|drivers?|recogni[sz]\w*|polic(y|ies)|risks?|strateg(y|ies)|"
+                                r"factors?|reasons?|caus\w*|impact\w*)\b", re.IGNORECASE)
+# Questions about a part of the year or of the company, the store only answers annual company totals
+PARTIAL_QUESTION = re.compile(r"\b(q[1-4]|quarters?|quarterly|months?|monthly|half|ytd|year[- ]to[- ]date|segments?|regions?|regional|geograph\w*|"
+                              r"products?|divisions?|business units?|countr(y|ies)|americas|europe|emea|asia|apac|china|japan|india|international|domestic)\b", re.IGNORECASE)
+# '2021-2023', 'from 2021 to 2023', 'between 2021 and 2023' ('2021, 2022 and 2023' is a list of years, not a range)
+YEAR_RANGE = re.compile(r"\b((?:19|20)\d{2})\s*(?:-|–|—|to|through|until)\s*((?:19|20)\d{2})\b|\bbetween\s+((?:19|20)\d{2})\s+and\s+((?:19|20)\d{2})\b", re.IGNORECASE)
+YEAR = re.compile(r"\b(?:fy\s?)?((?:19|20)\d{2})\b", re.IGNORECASE)
+LATEST = re.compile(r"\b(latest|last|recent|most recent|current)\b", re.IGNORECASE)
+AGGREGATIONS = [("growth", re.compile(r"\b(growth|grow|grew|change|changed|increase|increased|decrease|decreased|decline|declined|cagr)\b", re.IGNORECASE)),
+                ("average", re.compile(r"\b(average|mean)\b", re.IGNORECASE)),
+                ("sum", re.compile(r"\b(total|sum|combined|cumulative)\b.*\b(over|across|between|from)\b", re.IGNORECASE))]
+
+
+class CompanyFacts:
+    def __init__(self, cik: str, entity_name: str, arrays: dict):
+        """
+        Columnar store of one company's XBRL facts (companyfacts API), one row per (concept, unit, period)
+        Rows are sorted by concept, unit and period end, so a concept's rows are the slice offsets[i]:offsets[i + 1]
+        Args:
+            cik (str): 10 digit CIK
+            entity_name (str): company name reported in the facts
+            arrays (dict): concepts (str), labels (str), offsets, units (str), unit (int), start/end/filed (datetime64[D], start is NaT for instants),
+                value (float64), form (str), accession (str)
+        """
+        self.cik = cik
+        self.entity_name = entity_name
+        self.arrays = arrays
+        self.concept_index = {concept: i for i, concept in enumerate(arrays["concepts"].tolist())}
+        self.unit_index = {unit: i for i, unit in enumerate(arrays["units"].tolist())}
+        self.loaded = time.time()
+        self.metrics = {}
+        # Fiscal year ends: end dates of annual (about one year) periods reported in 10-Ks
+        annual = self._annual_durations(np.ones(len(arrays["value"]), dtype=bool))
+        self.year_ends = np.unique(arrays["end"][annual])
+
+    @classmethod
+    def from_json(cls, cik: str, data: dict) -> "CompanyFacts":
+        """
+        Build the columnar store from the companyfacts json, a period reported by several filings keeps the value of the latest filing (restated)
+        """
+        concepts, labels, units = [], [], []
+        unit_ids = {}
+        columns = {"concept": [], "unit": [], "start": [], "end": [], "value": [], "form": [], "filed": [], "accession": []}
+        for taxonomy, taxonomy_facts in data.get("facts", {}).items():
+            for name, fact in taxonomy_facts.items():
+                concept_id = len(concepts)
+                concepts.append(f"{taxonomy}:{name}")
+                labels.append(fact.get("label") or name)
+                for unit, values in fact.get("units", {}).items():
+                    unit_id = unit_ids.setdefault(unit, len(units))
+                    if unit_id == len(units):
+                        units.append(unit)
+                    for value in values:
+                        columns["concept"].append(concept_id)
+                        columns["unit"].append(unit_id)
+                        columns["start"].append(value.get("start", "NaT"))
+                        columns["end"].append(value["end"])
+                        columns["value"].append(value["val"])
+                        columns["form"].append(value.get("form", ""))
+                        columns["filed"].append(value.get("filed", "NaT"))
+                        columns["accession"].append(value.get("accn", ""))
+
+        concept = np.array(columns["concept"], dtype=np.int32)
+        unit = np.array(columns["unit"], dtype=np.int32)
+        start = np.array(columns["start"], dtype="datetime64[D]")
+        end = np.array(columns["end"], dtype="datetime64[D]")
+        filed = np.array(columns["filed"], dtype="datetime64[D]")
+        # Latest filing first within each (concept, unit, start, end), then keep the first row of each period
+        start_key = np.where(np.isnat(start), np.datetime64(0, "D"), start).astype(np.int64)
+        filed_key = np.where(np.isnat(filed), np.datetime64(0, "D"), filed).astype(np.int64)
+        order = np.lexsort((-filed_key, start_key, end.astype(np.int64), unit, concept))
+        keys = np.stack([concept[order], unit[order], end[order].astype(np.int64), start_key[order]], axis=1)
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+        order = order[first]
+
+        concept = concept[order]
+        arrays = {"concepts": np.array(concepts, dtype=str), "labels": np.array(labels, dtype=str), "units": np.array(units, dtype=str),
+                  "offsets": np.searchsorted(concept, np.arange(len(concepts) + 1)), "unit": unit[order], "start": start[order], "end": end[order],
+                  "value": np.array(columns["value"], dtype=np.float64)[order], "form": np.array(columns["form"], dtype=str)[order],
+                  "filed": filed[order], "accession": np.array(columns["accession"], dtype=str)[order]}
+        return cls(cik, data.get("entityName", ""), arrays)
+
+    def save(self, path: str):
+        np.savez(path, entity_name=np.array(self.entity_name), **self.arrays)
+
+    @classmethod
+    def load(cls, cik: str, path: str) -> "CompanyFacts":
+        with np.load(path, allow_pickle=False) as saved:
+            arrays = {key: saved[key] for key in saved.files if key != "entity_name"}
+            return cls(cik, str(saved["entity_name"]), arrays)
+
+    def _annual_durations(self, rows) -> np.ndarray:
+        """
+        Mask of rows (slice or mask) that are annual periods reported in 10-K filings
+        """
+        start, end, form = self.arrays["start"][rows], self.arrays["end"][rows], self.arrays["form"][rows]
+        days = (end - start).astype(np.int64)
+        return ~np.isnat(start) & (days >= 350) & (days <= 380) & np.char.startswith(form, "10-K")
+
+    def get_facts(self, concept: str, unit: str=None) -> dict:
+        """
+        All facts of a concept ('us-gaap:Revenues')
+        Args:
+            unit (str): only facts in this unit ('USD', 'USD/shares', 'shares')
+        Returns:
+            dict: column arrays {unit, start, end, value, form, filed, accession}, empty if the company does not report the concept
+        """
+        i = self.concept_index.get(concept)
+        if i is None:
+            return {}
+        rows = slice(self.arrays["offsets"][i], self.arrays["offsets"][i + 1])
+        facts = {key: self.arrays[key][rows] for key in ("unit", "start", "end", "value", "form", "filed", "accession")}
+        if unit is not None:
+            mask = facts["unit"] == self.unit_index.get(unit, -1)
+            facts = {key: values[mask] for key, values in facts.items()}
+        return facts
+
+    def get_annual(self, concept: str) -> dict:
+        """
+        Fiscal year values of a concept from 10-K filings: annual periods for flows (revenue), fiscal year end balances for stocks (assets)
+        The fiscal year is the calendar year of the period end.
+        Returns:
+            dict: {year: {"value", "unit", "start", "end", "form", "filed", "accession"}}
+        """
+        facts = self.get_facts(concept)
+        if not facts:
+            return {}
+        is_instant = np.isnat(facts["start"])
+        days = (facts["end"] - facts["start"]).astype(np.int64)
+        annual = ~is_instant & (days >= 350) & (days <= 380) & np.char.startswith(facts["form"], "10-K")
+        if not annual.any():
+            annual = is_instant & np.char.startswith(facts["form"], "10-K")
+            if len(self.year_ends) and np.isin(facts["end"][annual], self.year_ends).any():
+                annual &= np.isin(facts["end"], self.year_ends)
+        units = self.arrays["units"]
+        values = {}
+        # Rows are sorted by end date, a later period end in the same year wins
+        for row in np.flatnonzero(annual):
+            year = int(str(facts["end"][row])[:4])
+            values[year] = {"value": float(facts["value"][row]), "unit": str(units[facts["unit"][row]]), "start": None if is_instant[row] else str(facts["start"][row]),
+                            "end": str(facts["end"][row]), "form": str(facts["form"][row]), "filed": str(facts["filed"][row]), "accession": str(facts["accession"][row])}
+        return values
+
+    def get_metric(self, concepts: list) -> dict:
+        """
+        Fiscal year values of a metric, each year from the first of concepts reporting it (memoized, facts are immutable)
+        Returns:
+            dict: {year: {"value", "unit", "concept", ...}} sorted by year
+        """
+        key = tuple(concepts)
+        if key not in self.metrics:
+            values = {}
+            for concept in concepts:
+                for year, fact in self.get_annual(concept).items():
+                    values.setdefault(year, {**fact, "concept": concept})
+            self.metrics[key] = dict(sorted(values.items()))
+        return self.metrics[key]
+
+
+class XbrlFacts:
+    def __init__(self, client: EdgarClient, store_dir: str=".cache/xbrl", max_age: float=24 * 60 * 60):
+        """
+        Local store of XBRL company facts (data.sec.gov/api/xbrl/companyfacts) for exact answers to numeric questions
+        Each company's facts are kept as numpy arrays (CompanyFacts) in memory and in an .npz file per CIK,
+        refreshed from EDGAR after max_age. Questions asking for a reported figure ('What was revenue growth 2021-2023?')
+        are answered by an indexed lookup instead of retrieval and generation.
+        Args:
+            client (EdgarClient): shared EDGAR http client
+            store_dir (str): directory of the .npz files
+            max_age (float): seconds before a company's facts are fetched again
+        """
+        self.client = client
+        self.store_dir = store_dir
+        self.max_age = max_age
+        self.companies = {}
+        self.lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+
+    def get_company(self, cik: str) -> CompanyFacts:
+        """
+        Facts of a company from memory, the store or EDGAR
+        Args:
+            cik (str): CIK of the company
+        Returns:
+            CompanyFacts: None if EDGAR has no XBRL facts for the company
+        """
+        cik = str(cik).zfill(10)
+        with self.lock:
+            company = self.companies.get(cik)
+        if company is not None and time.time() - company.loaded < self.max_age:
+            return company
+        path = os.path.join(self.store_dir, f"CIK{cik}.npz")
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < self.max_age:
+            with tracer.span("xbrl.load", cik=cik):
+                company = CompanyFacts.load(cik, path)
+        else:
+            with tracer.span("xbrl.fetch", cik=cik) as span:
+                try:
+                    data = self.client.get_json(f"https://data.sec.gov/api/xbrl/companyfacts/CIK{cik}.json")
+                except Exception as e:
+                    print(f"XBRL facts for CIK {cik} not available: {e}")
+                    return None
+                company = CompanyFacts.from_json(cik, data)
+                company.save(path)
+                span["facts"] = len(company.arrays["value"])
+        company.loaded = os.path.getmtime(path)
+        with self.lock:
+            self.companies[cik] = company
+        return company
+
+    def get_series(self, cik: str, metric: str, years: list=None) -> dict:
+        """
+        Fiscal year values of a metric
+        Args:
+            cik (str): CIK of the company
+            metric (str): metric label of METRICS ('Revenue') or a concept ('us-gaap:Revenues')
+            years (list[int]): only these fiscal years
+        Returns:
+            dict: {year: {"value", "unit", "concept", "end", "filed", "accession", ...}}
+        """
+        company = self.get_company(cik)
+        if company is None:
+            return {}
+        concepts = next((concepts for _, label, concepts in METRICS if label.lower() == metric.lower()), [metric])
+        series = company.get_metric(concepts)
+        return {year: fact for year, fact in series.items() if years is None or year in years}
+
+    def aggregate(self, cik: str, metric: str, years: list, how: str="value") -> dict:
+        """
+        Aggregate a metric over fiscal years
+        Args:
+            how (str): 'value' (values per year), 'growth' (first to last year: change, percent change, CAGR), 'average' or 'sum'
+        Returns:
+            dict: {"series": {year: fact}, "result": {...}} or None if no year has a value
+        """
+        series = self.get_series(cik, metric, years)
+        if not series:
+            return None
+        values = [fact["value"] for fact in series.values()]
+        first, last = min(series), max(series)
+        result = {}
+        if how == "growth" and first != last:
+            change = series[last]["value"] - series[first]["value"]
+            result = {"from": first, "to": last, "change": change}
+            if series[first]["value"] > 0 and series[last]["value"] > 0:
+                result["percent"] = change / series[first]["value"] * 100
+                result["cagr"] = ((series[last]["value"] / series[first]["value"]) ** (1 / (last - first)) - 1) * 100
+        elif how == "average":
+            result = {"average": float(np.mean(values))}
+        elif how == "sum":
+            result = {"sum": float(np.sum(values))}
+        return {"series": series, "result": result}
+
+    def parse_question(self, question: str) -> dict:
+        """
+        Metric, fiscal years and aggregation of a numeric question
+            'What was revenue growth 2021-2023?' -> {"metric": "Revenue", "concepts": [...], "years": [2021, 2022, 2023], "how": "growth"}
+            'How was revenue growth 2021-2023 explained by management?' -> None
+            'What drove the revenue decline discussed for 2022?' -> None
+            'What was total revenue for 2021, 2022 and 2023?' -> {..., "years": [2021, 2022, 2023], "how": "value"}
+            'What was revenue in Q3 2023?', 'What was the revenue of the cloud segment in 2023?' -> None (not an annual company total)
+        Returns:
+            dict: None if the question does not ask for a reported annual figure (years=None: latest fiscal year)
+        """
+        if not NUMERIC_QUESTION.search(question) or NARRATIVE_QUESTION.search(question) or PARTIAL_QUESTION.search(question):
+            return None
+        lowered = question.lower()
+        metric = next(((label, concepts) for pattern, label, concepts in METRICS if re.search(pattern, lowered)), None)
+        if metric is None:
+            return None
+        years = {int(year) for year in YEAR.findall(question)}
+        for year_range in YEAR_RANGE.finditer(question):
+            first, last = sorted(int(year) for year in year_range.groups() if year)
+            years.update(range(first, last + 1))
+        years = sorted(years) or None
+        if years is None and not LATEST.search(question):
+            return None
+        how = next((how for how, pattern in AGGREGATIONS if pattern.search(question)), "value")
+        return {"metric": metric[0], "concepts": metric[1], "years": years, "how": how}
+
+    def answer(self, question: str, ciks: list) -> dict:
+        """
+        Answer a numeric question from the facts of the session's companies
+        Companies named in the question are answered if any, otherwise all of ciks.
+        Args:
+            question (str): user question
+            ciks (list[str]): CIKs of the session's companies
+        Returns:
+            dict: {"answer": str, "context": list[Document]} or None if the question is not numeric or no figure is reported
+        """
+        with tracer.span("xbrl.answer") as span:
+            parsed = self.parse_question(question)
+            if parsed is None or not ciks:
+                return None
+            companies = [company for company in (self.get_company(cik) for cik in ciks) if company is not None]
+            named = [company for company in companies if company.entity_name and self._is_named(company.entity_name, question)]
+            lines, context = [], []
+            for company in named or companies:
+                series = company.get_metric(parsed["concepts"])
+                years = parsed["years"] or sorted(series)[-1:]
+                aggregated = self.aggregate(company.cik, parsed["metric"], years, parsed["how"])
+                if aggregated is None:
+                    continue
+                text = self._format(company.entity_name, parsed["metric"], aggregated, years)
+                lines.append(text)
+                latest = aggregated["series"][max(aggregated["series"])]
+                context.append(Document(page_content=text, metadata={"cik": company.cik, "details": f"XBRL: {parsed['metric']}", "concept": latest["concept"],
+                                                                     "accession": latest["accession"], "filing date": latest["filed"], "source": "companyfacts"}))
+            span["answered"] = int(bool(lines))
+            if not lines:
+                return None
+        tracer.count("xbrl.answers")
+        return {"answer": "\n\n".join(lines), "context": context}
+
+    def _is_named(self, entity_name: str, question: str) -> bool:
+        words = [word for word in re.findall(r"\w+", entity_name.lower()) if word not in ("inc", "corp", "corporation", "co", "company", "ltd", "plc", "the", "group", "holdings")]
+        return bool(words) and words[0] in re.findall(r"\w+", question.lower())
+
+    def _format_value(self, value: float, unit: str) -> str:
+        if unit == "USD":
+            return f"{'-' if value < 0 else ''}${abs(value):,.0f}"
+        if unit.startswith("USD/"):
+            return f"${value:,.2f} per {unit.split('/', 1)[1].rstrip('s')}"
+        return f"{value:,.0f} {unit}"
+
+    def _format(self, entity_name: str, metric: str, aggregated: dict, years: list) -> str:
+        """
+        Answer text with the exact reported figures, years without a figure are named
+        """
+        series, result = aggregated["series"], aggregated["result"]
+        lines = [f"{entity_name} {metric} as reported in its 10-K XBRL financial data:"]
+        for year, fact in series.items():
+            lines.append(f"FY{year} (period ended {fact['end']}): {self._format_value(fact['value'], fact['unit'])}")
+        unit = next(iter(series.values()))["unit"]
+        if "change" in result:
+            line = f"Change FY{result['from']} to FY{result['to']}: {self._format_value(result['change'], unit)}"
+            if "percent" in result:
+                line += f" ({result['percent']:+.1f}%, CAGR {result['cagr']:+.1f}%)"
+            lines.append(line)
+        if "average" in result:
+            lines.append(f"Average over FY{min(series)}-FY{max(series)}: {self._format_value(result['average'], unit)}")
+        if "sum" in result:
+            lines.append(f"Total over FY{min(series)}-FY{max(series)}: {self._format_value(result['sum'], unit)}")
+        missing = sorted(set(years) - set(series))
+        if missing:
+            lines.append(f"No figure reported for FY{', FY'.join(map(str, missing))}.")
+        return "\n".join(lines)